@@ -0,0 +1,124 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Dict, List, Optional
+
+import yacc
+from build import compile_source, format_code, objective
+from optimizer import Objective
+from profiling import Profiler, save_trace
+from superopt import Superoptimizer
+
+ext = ".nhs"
+
+
+def warm() -> None:
+    # every worker builds its own parser once, before its first job
+    yacc.get_parser()
+
+
+def read_inbox(path: str) -> Optional[List[int]]:
+    # a sample inbox for the cost model, whitespace separated, next to the source
+    inbox = os.path.splitext(path)[0] + ".inbox"
+    if not os.path.exists(inbox):
+        return None
+    with open(inbox) as f:
+        return [int(v) for v in f.read().split()]
+
+
+def compile_file(path: str,
+                 optimize_for: Objective = "size",
+                 superopt: Optional[str] = None,
+                 window: int = 5,
+                 profile: bool = False) -> Dict:
+    # superopt is the path of the superoptimizer's cache file, which turns it on;
+    # with profile the result carries the phase and pass timings under "profile"
+    with open(path) as f:
+        source = f.read()
+    profiler = Profiler() if profile else None
+    try:
+        so = Superoptimizer(window, superopt) if superopt is not None else None
+        hrm, stats = compile_source(source, optimize_for=optimize_for, inbox=read_inbox(path), superopt=so,
+                                    profiler=profiler)
+    except Exception as e:
+        return {"file": path, "error": f"{type(e).__name__}: {e}"}
+    finally:
+        if profiler is not None:
+            profiler.stop()
+    if profiler is not None:
+        stats["profile"] = profiler.to_json()
+    out = os.path.splitext(path)[0] + ".hrm"
+    with open(out, "w") as f:
+        f.write(format_code(hrm))
+    return dict(file=path, output=out, **stats)
+
+
+def find_sources(root: str, ext: str = ext) -> List[str]:
+    paths = []
+    for d, _, files in os.walk(root):
+        paths.extend(os.path.join(d, f) for f in files if f.endswith(ext))
+    return sorted(paths)
+
+
+def compile_all(paths: List[str],
+                jobs: Optional[int] = None,
+                optimize_for: Objective = "size",
+                superopt: Optional[str] = None,
+                window: int = 5,
+                profile: bool = False) -> List[Dict]:
+    job = partial(compile_file, optimize_for=optimize_for, superopt=superopt, window=window, profile=profile)
+    if jobs == 1:
+        warm()
+        return [job(p) for p in paths]
+    workers = jobs or os.cpu_count() or 1
+    chunksize = max(1, len(paths) // (4 * workers))
+    with ProcessPoolExecutor(max_workers=workers, initializer=warm) as pool:
+        return list(pool.map(job, paths, chunksize=chunksize))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="compile every source file under a directory to .hrm")
+    ap.add_argument("root")
+    ap.add_argument("-e", "--ext", default=ext, help=f"source file extension (default: {ext})")
+    ap.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (default: cpu count)")
+    ap.add_argument("-o", "--summary", default=None, help="JSON summary path (default: <root>/summary.json)")
+    ap.add_argument("-O", "--optimize-for", type=objective, default="size",
+                    help="size, speed or a weight of size against steps in [0, 1] (default: size)")
+    ap.add_argument("-s", "--superopt", default=None, metavar="CACHE",
+                    help="run the superoptimizer, keeping the rewrites it finds in this JSON file")
+    ap.add_argument("-w", "--window", type=int, default=5,
+                    help="longest window the superoptimizer rewrites (default: 5)")
+    ap.add_argument("-p", "--profile", action="store_true",
+                    help="time and trace allocation of each phase and pass run, kept per file in the summary")
+    ap.add_argument("-t", "--trace", default=None, metavar="PATH",
+                    help="profile and write a Chrome trace (chrome://tracing, Perfetto) with a thread per file")
+    args = ap.parse_args()
+
+    start = time.perf_counter()
+    results = compile_all(find_sources(args.root, args.ext), args.jobs, args.optimize_for, args.superopt, args.window,
+                          args.profile or args.trace is not None)
+    if args.trace is not None:
+        save_trace(args.trace, [(r["file"], r["profile"]["events"]) for r in results if "profile" in r])
+        if not args.profile:
+            for r in results:
+                r.pop("profile", None)
+    summary = {
+        "files": results,
+        "failed": sum(1 for r in results if "error" in r),
+        "time": time.perf_counter() - start,
+    }
+    path = args.summary or os.path.join(args.root, "summary.json")
+    with open(path, "w") as f:
+        json.dump(summary, f, indent=2)
+    for r in results:
+        if "error" in r:
+            print(f"{r['file']}: {r['error']}")
+    print(f"{len(results)} files, {summary['failed']} failed, {summary['time']:.2f} s -> {path}")
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,222 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from compiler import Instrument, indirect
+from simulator import decode, lower, upper
+
+# why a lane stopped early; the messages are the ones simulator.simulate raises
+POINTER_EMPTY, POINTER_OUT, TILE_EMPTY, HANDS_EMPTY, OVERFLOW, STEP_LIMIT = range(1, 7)
+
+
+class Lanes:
+    # N machine states side by side; a lane is retired when its inbox runs out, it leaves
+    # the program or it fails
+    def __init__(self,
+                 inboxes: Sequence[Sequence[int]],
+                 floor: Optional[Dict[int, int]],
+                 max_steps: int) -> None:
+        n = len(inboxes)
+        if isinstance(inboxes, np.ndarray):
+            self.inbox = inboxes.astype(np.int64).reshape(n, -1)
+            self.length = np.full(n, self.inbox.shape[1], dtype=np.int64)
+        else:
+            self.length = np.array([len(box) for box in inboxes], dtype=np.int64)
+            self.inbox = np.zeros((n, max(int(self.length.max(initial=0)), 1)), dtype=np.int64)
+            for i, box in enumerate(inboxes):
+                self.inbox[i, :len(box)] = box
+        # the floors of all lanes, tile t of lane i at i * indirect + t
+        self.tiles = np.zeros(n * indirect, dtype=np.int64)
+        self.full = np.zeros(n * indirect, dtype=bool)
+        for t, v in (floor or {}).items():
+            self.tiles[t::indirect] = v
+            self.full[t::indirect] = True
+        self.hand = np.zeros(n, dtype=np.int64)
+        self.held = np.zeros(n, dtype=bool)
+        self.cursor = np.zeros(n, dtype=np.int64)
+        self.pc = np.zeros(n, dtype=np.int64)
+        # every live lane runs one instruction a round, so steps are set when a lane retires
+        self.steps = np.zeros(n, dtype=np.int64)
+        self.round = 0
+        self.active = np.ones(n, dtype=bool)
+        self.outbox = np.zeros((n, 8), dtype=np.int64)
+        self.outlen = np.zeros(n, dtype=np.int64)
+        self.error = np.zeros(n, dtype=np.int8)
+        self.error_arg = np.zeros(n, dtype=np.int64)
+        self.max_steps = max_steps
+
+    def fail(self, lanes: np.ndarray, bad: np.ndarray, error: int, arg) -> np.ndarray:
+        # retire the lanes where bad is set; returns the mask of the others
+        self.steps[lanes[bad]] = self.round if error == STEP_LIMIT else self.round + 1
+        self.error[lanes[bad]] = error
+        self.error_arg[lanes[bad]] = arg[bad] if isinstance(arg, np.ndarray) else arg
+        self.active[lanes[bad]] = False
+        return ~bad
+
+    def address(self, g: np.ndarray, arg: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # cells of the tiles named by arg, following pointers; lanes with a bad pointer fail
+        base = g * indirect
+        ind = arg >= indirect
+        if not ind.any():
+            return g, base + arg
+        ptr = np.where(ind, arg - indirect, 0)
+        bad = ind & ~self.full[base + ptr]
+        if bad.any():
+            keep = self.fail(g, bad, POINTER_EMPTY, ptr)
+            g, base, arg, ind, ptr = g[keep], base[keep], arg[keep], ind[keep], ptr[keep]
+        t = np.where(ind, self.tiles[base + ptr], arg)
+        bad = (t < 0) | (t >= indirect)
+        if bad.any():
+            keep = self.fail(g, bad, POINTER_OUT, t)
+            g, base, t = g[keep], base[keep], t[keep]
+        return g, base + t
+
+    def load(self, g: np.ndarray, arg: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        g, cell = self.address(g, arg)
+        bad = ~self.full[cell]
+        if bad.any():
+            keep = self.fail(g, bad, TILE_EMPTY, cell % indirect)
+            g, cell = g[keep], cell[keep]
+        return g, cell, self.tiles[cell]
+
+    def holding(self, g: np.ndarray, code: int, *rest: np.ndarray) -> Tuple[np.ndarray, ...]:
+        bad = ~self.held[g]
+        if not bad.any():
+            return (g,) + rest
+        keep = self.fail(g, bad, HANDS_EMPTY, code)
+        return (g[keep],) + tuple(r[keep] for r in rest)
+
+    def check(self, g: np.ndarray, v: np.ndarray, *rest: np.ndarray) -> Tuple[np.ndarray, ...]:
+        bad = (v < lower) | (v > upper)
+        if not bad.any():
+            return (g, v) + rest
+        keep = self.fail(g, bad, OVERFLOW, v)
+        return (g[keep], v[keep]) + tuple(r[keep] for r in rest)
+
+    def put(self, lanes: np.ndarray, v: np.ndarray) -> None:
+        if len(lanes) > 0 and self.outlen[lanes].max() == self.outbox.shape[1]:
+            self.outbox = np.concatenate([self.outbox, np.zeros_like(self.outbox)], axis=1)
+        self.outbox[lanes, self.outlen[lanes]] = v
+        self.outlen[lanes] += 1
+
+    def message(self, lane: int) -> Optional[str]:
+        error = self.error[lane]
+        arg = int(self.error_arg[lane])
+        if error == POINTER_EMPTY:
+            return f"pointer tile {arg} is empty"
+        elif error == POINTER_OUT:
+            return f"pointer {arg} out of floor"
+        elif error == TILE_EMPTY:
+            return f"tile {arg} is empty"
+        elif error == HANDS_EMPTY:
+            return f"{Instrument.names[arg]} with empty hands"
+        elif error == OVERFLOW:
+            return f"overflow {arg}"
+        elif error == STEP_LIMIT:
+            return f"exceeded {self.max_steps} steps"
+        return None
+
+
+def step(lanes: Lanes, g: np.ndarray, code: int, p: np.ndarray, args: np.ndarray, idxs: np.ndarray,
+         hits: np.ndarray) -> None:
+    # one opcode for the lanes g at the pcs p, each with the operand of its own instruction
+    if code == Instrument.IN:
+        done = lanes.cursor[g] == lanes.length[g]
+        if done.any():
+            lanes.active[g[done]] = False
+            lanes.steps[g[done]] = lanes.round
+            g, p = g[~done], p[~done]
+    if lanes.round == lanes.max_steps:
+        lanes.fail(g, np.ones(len(g), dtype=bool), STEP_LIMIT, 0)
+        return
+    arg = args[p]
+    hits += np.bincount(idxs[p], minlength=len(hits))
+    lanes.pc[g] = p + 1
+    if code == Instrument.IN:
+        lanes.hand[g] = lanes.inbox[g, lanes.cursor[g]]
+        lanes.held[g] = True
+        lanes.cursor[g] += 1
+    elif code == Instrument.OUT:
+        g, = lanes.holding(g, code)
+        lanes.put(g, lanes.hand[g])
+        lanes.held[g] = False
+    elif code == Instrument.CPF:
+        g, _, v = lanes.load(g, arg)
+        lanes.hand[g] = v
+        lanes.held[g] = True
+    elif code == Instrument.CPT:
+        g, arg = lanes.holding(g, code, arg)
+        g, cell = lanes.address(g, arg)
+        lanes.tiles[cell] = lanes.hand[g]
+        lanes.full[cell] = True
+    elif code in (Instrument.INC, Instrument.DEC):
+        g, cell, v = lanes.load(g, arg)
+        g, v, cell = lanes.check(g, v + 1 if code == Instrument.INC else v - 1, cell)
+        lanes.tiles[cell] = v
+        lanes.hand[g] = v
+        lanes.held[g] = True
+    elif code in (Instrument.ADD, Instrument.SUB):
+        g, arg = lanes.holding(g, code, arg)
+        g, _, v = lanes.load(g, arg)
+        g, v = lanes.check(g, lanes.hand[g] + v if code == Instrument.ADD else lanes.hand[g] - v)
+        lanes.hand[g] = v
+    elif code == Instrument.JMP:
+        lanes.pc[g] = arg
+    elif code in (Instrument.JZ, Instrument.JN):
+        g, arg = lanes.holding(g, code, arg)
+        h = lanes.hand[g]
+        taken = h == 0 if code == Instrument.JZ else h < 0
+        lanes.pc[g[taken]] = arg[taken]
+    else:
+        raise ValueError(f"unknown instrument {code}")
+
+
+def simulate_batch(hrm: List[Instrument],
+                   inboxes: Sequence[Sequence[int]],
+                   floor: Optional[Dict[int, int]] = None,
+                   max_steps: int = 1000000) -> Tuple[List[List[int]], np.ndarray, np.ndarray, List[Optional[str]]]:
+    # simulator.simulate on every inbox at once. Lanes advance in lockstep; each round the
+    # live lanes are grouped by the opcode at their pc and every group runs as a handful of
+    # array operations, with the operand of each lane's own instruction.
+    # Returns the outboxes, the step counts, the hits of each instruction summed over all
+    # lanes and, per lane, None or the error simulate would have raised.
+    prog = decode(hrm)
+    # one extra entry past the end, where lanes halt
+    halt = len(Instrument.names)
+    codes = np.array([c for c, _, _ in prog] + [halt], dtype=np.int8)
+    args = np.array([a if a is not None else 0 for _, a, _ in prog] + [0], dtype=np.int64)
+    idxs = np.array([i for _, _, i in prog] + [0], dtype=np.int64)
+    lanes = Lanes(inboxes, floor, max_steps)
+    hits = np.zeros(len(hrm), dtype=np.int64)
+    while True:
+        live = np.flatnonzero(lanes.active)
+        if len(live) == 0:
+            break
+        pc = np.minimum(lanes.pc[live], len(prog))
+        code = codes[pc]
+        order = np.argsort(code, kind="stable")
+        live, pc, code = live[order], pc[order], code[order]
+        cuts = np.flatnonzero(code[1:] != code[:-1]) + 1
+        for s, e in zip(np.concatenate(([0], cuts)).tolist(), np.concatenate((cuts, [len(live)])).tolist()):
+            g, p, c = live[s:e], pc[s:e], int(code[s])
+            if c == halt:
+                lanes.active[g] = False
+                lanes.steps[g] = lanes.round
+                continue
+            step(lanes, g, c, p, args, idxs, hits)
+        lanes.round += 1
+    outboxes = [row[:k].tolist() for row, k in zip(lanes.outbox, lanes.outlen)]
+    errors = [lanes.message(i) for i in range(len(lanes.error))]
+    return outboxes, lanes.steps, hits, errors
+
+
+def differences(a: List[Instrument],
+                b: List[Instrument],
+                inboxes: Sequence[Sequence[int]],
+                floor: Optional[Dict[int, int]] = None,
+                max_steps: int = 100000) -> List[int]:
+    # lanes where a runs without error and b gives another outbox or fails;
+    # b may do anything where a fails, as the optimizer can drop code that would fault
+    out_a, _, _, err_a = simulate_batch(a, inboxes, floor, max_steps)
+    out_b, _, _, err_b = simulate_batch(b, inboxes, floor, max_steps)
+    return [i for i in range(len(out_a)) if err_a[i] is None and (err_b[i] is not None or out_a[i] != out_b[i])]
@@ -0,0 +1,60 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batchsim import simulate_batch  # noqa: E402
+from build import const_tiles, make_context, parse, reserved  # noqa: E402
+from compiler import Call  # noqa: E402
+from optimizer import optimize  # noqa: E402
+
+source = """main = do {
+    x <- read;
+    y <- read;
+    if gt x y
+        then count x y
+        else count y x;
+    main
+    }
+count a b
+    | eq a b = write a
+    | gt a b = do {
+        write (sub a b);
+        count (sub a 1) b
+        }
+"""
+
+
+def main():
+    ap = argparse.ArgumentParser(description="outputs of emitted and optimized code over random inboxes")
+    ap.add_argument("files", nargs="*", help="sources (default: a built-in countdown)")
+    ap.add_argument("-n", "--inboxes", type=int, default=100000)
+    ap.add_argument("-l", "--length", type=int, default=8)
+    ap.add_argument("-r", "--range", type=int, default=9, help="inbox values are in [-range, range]")
+    args = ap.parse_args()
+    rng = np.random.default_rng(0)
+    inboxes = rng.integers(-args.range, args.range + 1, size=(args.inboxes, args.length))
+    floor = {t: v for v, t in const_tiles.items()}
+    sources = [(path, open(path).read()) for path in args.files] or [("countdown", source)]
+    for name, src in sources:
+        emitted = Call("main", []).emit(make_context(parse(src)))
+        _, optimized = optimize(emitted, reserved)
+        t = time.perf_counter()
+        out_a, steps_a, _, err_a = simulate_batch(emitted, inboxes, floor, 100000)
+        out_b, steps_b, _, err_b = simulate_batch(optimized, inboxes, floor, 100000)
+        elapsed = time.perf_counter() - t
+        clean = [i for i, e in enumerate(err_a) if e is None]
+        diff = sum(1 for i in clean if err_b[i] is not None or out_a[i] != out_b[i])
+        print(f"{name}: {len(inboxes)} inboxes in {elapsed:.2f} s, {len(clean)} ran clean, {diff} differ; "
+              f"mean steps {steps_a[clean].mean():.1f} -> {steps_b[clean].mean():.1f}")
+        if diff:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,49 @@
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from client import Client  # noqa: E402
+from server import CompileServer  # noqa: E402
+
+source = """main = do {
+    x <- read;
+    if gt x 0
+        then write x
+        else write (sub x 1);
+    main
+    }"""
+
+
+def main():
+    ap = argparse.ArgumentParser(description="request latency of a warm compile server")
+    ap.add_argument("-n", "--requests", type=int, default=2000)
+    args = ap.parse_args()
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "bench.sock")
+        with CompileServer(path) as server:
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            with Client(path) as client:
+                t = time.perf_counter()
+                first = client.compile(source)
+                cold = time.perf_counter() - t
+                assert not first["cached"]
+                times = []
+                for _ in range(args.requests):
+                    t = time.perf_counter()
+                    client.compile(source)
+                    times.append(time.perf_counter() - t)
+            server.shutdown()
+    times.sort()
+    print(f"{'first compile':20s}{cold * 1000:8.3f} ms")
+    print(f"{'cached median':20s}{statistics.median(times) * 1000:8.3f} ms")
+    print(f"{'cached p99':20s}{times[int(len(times) * 0.99)] * 1000:8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
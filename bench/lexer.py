@@ -0,0 +1,93 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import lex  # noqa: E402
+from scan import Scanner  # noqa: E402
+
+program = """main = do {
+    x <- read;
+    if gt x 0
+        then print_dn{n} x
+        else print_up{n} (add x -1);
+    main
+    }
+print_dn{n} x
+    | eq x 0 = write x
+    | gt x 0 = do {
+        write x;
+        print_dn{n} (sub x 1)
+        }
+print_up{n} x
+    | eq x 0 = write x
+    | lt x 0 = do {
+        write x;
+        print_up{n} (add x 1)
+        }
+"""
+
+
+def generate(size: int) -> str:
+    parts = []
+    total = 0
+    n = 0
+    while total < size:
+        part = program.replace("{n}", str(n))
+        parts.append(part)
+        total += len(part)
+        n += 1
+    return "".join(parts)
+
+
+def run(lexer, source: str) -> list:
+    lexer.input(source)
+    toks = []
+    token = lexer.token
+    while True:
+        t = token()
+        if t is None:
+            return toks
+        toks.append(t)
+
+
+def same_tokens(source: str) -> bool:
+    ply_toks = run(lex.get_lexer().clone(), source)
+    scan_toks = run(Scanner(), source)
+    return [(t.type, t.value, t.lineno, t.lexpos) for t in ply_toks] == \
+           [(t.type, t.value, t.lineno, t.lexpos) for t in scan_toks]
+
+
+def best(lexer, source: str, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        run(lexer, source)
+        times.append(time.perf_counter() - t)
+    return min(times)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="PLY lexer against the single-regex scanner")
+    ap.add_argument("-m", "--megabytes", type=float, nargs="+", default=[1, 4])
+    ap.add_argument("-r", "--repeat", type=int, default=3)
+    args = ap.parse_args()
+    # blanks with no newline after them at the very end of the input
+    for tail in [" ", "\t", " \t ", "\n    ", " }  "]:
+        if not same_tokens(program + tail):
+            raise RuntimeError(f"token streams differ with {tail!r} at the end")
+    for mb in args.megabytes:
+        source = generate(int(mb * 1024 * 1024))
+        if not same_tokens(source):
+            raise RuntimeError("token streams differ")
+        scan_toks = run(Scanner(), source)
+        ply_time = best(lex.get_lexer().clone(), source, args.repeat)
+        scan_time = best(Scanner(), source, args.repeat)
+        print(f"{mb:6.1f} MB {len(scan_toks):9d} tokens  ply {ply_time:7.3f} s  "
+              f"scan {scan_time:7.3f} s  x{ply_time / scan_time:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+source = """main = do {
+    x <- read;
+    if gt x 0
+        then write x
+        else write (sub x 1);
+    main
+    }"""
+
+# each snippet prints the seconds it took, measured inside a fresh interpreter; the parses
+# are timed after their imports, which both pay alike
+snippets = {
+    "import compiler, optimizer": """
+import time
+t = time.perf_counter()
+import compiler, optimizer
+print(time.perf_counter() - t)
+""",
+    "import lex, yacc": """
+import time
+t = time.perf_counter()
+import lex, yacc
+print(time.perf_counter() - t)
+""",
+    "first parse (stored tables)": """
+import time
+import yacc
+t = time.perf_counter()
+yacc.parser.parse(%r)
+print(time.perf_counter() - t)
+""" % source,
+    # what every process did on import before the tables were stored
+    "first parse (tables rebuilt)": """
+import time
+import ply.lex, ply.yacc
+import lex, yacc
+t = time.perf_counter()
+ply.lex.lex(module=lex)
+ply.yacc.yacc(module=yacc, tabmodule="no_parsetab", write_tables=False, debug=False)
+ply.yacc.parse(%r)
+print(time.perf_counter() - t)
+""" % source,
+}
+
+
+def measure(snippet: str, runs: int) -> float:
+    env = dict(os.environ, PYTHONPATH=root)
+    times = []
+    with tempfile.TemporaryDirectory() as cwd:
+        for _ in range(runs):
+            out = subprocess.run([sys.executable, "-c", snippet], cwd=cwd, env=env,
+                                 capture_output=True, text=True, check=True).stdout
+            times.append(float(out.split()[-1]))
+        if os.listdir(cwd):
+            raise RuntimeError(f"files written to the working directory: {os.listdir(cwd)}")
+    return statistics.median(times)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="startup latency of the compiler modules")
+    ap.add_argument("-n", "--runs", type=int, default=10)
+    args = ap.parse_args()
+    times = {}
+    for name, snippet in snippets.items():
+        times[name] = measure(snippet, args.runs)
+        print(f"{name:30s}{times[name] * 1000:8.2f} ms")
+    stored = times["first parse (stored tables)"]
+    rebuilt = times["first parse (tables rebuilt)"]
+    print(f"stored tables save {(rebuilt - stored) * 1000:.2f} ms per process (x{rebuilt / stored:.1f})")
+    if stored >= rebuilt:
+        raise SystemExit("stored tables are not faster than rebuilding them")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+import argparse
+import json
+import os
+import random
+import sys
+import zlib
+from typing import Callable, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from build import compile_source, const_tiles, objective  # noqa: E402
+from profiling import Profiler  # noqa: E402
+from simulator import simulate  # noqa: E402
+
+here = os.path.dirname(os.path.abspath(__file__))
+default_baseline = os.path.join(here, "baseline.json")
+phases = ["lex", "parse", "emit", "optimize"]
+quality = ["instructions", "tiles", "steps"]
+
+# the readme puzzles: source, inboxes and the outbox each inbox must give
+puzzles = {
+    "puzzle_02": ("""main = do {
+    write read;
+    main
+    }
+""", [[3, -7, 0, 12], []], [[3, -7, 0, 12], []]),
+    "puzzle_14": ("""main = do {
+    a <- read;
+    b <- read;
+    if gt a b
+        then write a
+        else write b;
+    main
+    }
+""", [[3, 8, -2, -9, 5, 5, 0, -1]], [[8, -2, 5, 0]]),
+    "puzzle_19": ("""main = do {
+    x <- read;
+    if gt x 0
+        then print_dn x
+        else print_up x;
+    main
+    }
+print_dn x
+    | eq x 0 = write x
+    | gt x 0 = do {
+        write x;
+        print_dn (sub x 1)
+        }
+print_up x
+    | eq x 0 = write x
+    | lt x 0 = do {
+        write x;
+        print_up (add x 1)
+        }
+""", [[3, -2, 0], [9]], [[3, 2, 1, 0, -2, -1, 0, 0], [9, 8, 7, 6, 5, 4, 3, 2, 1, 0]]),
+    "puzzle_20": ("""main = do {
+    write (mul read read (addr 9));
+    main
+}
+
+mul a b acc
+    | eq a 0 = addr 9
+    | eq b 0 = addr 9
+    | eq b 1 = add acc a
+    | gt b 1 = mul a (sub b 1) (add acc a)
+""", [[3, 4, 0, 7, 6, 1, 5, 0], [9, 9]], [[12, 0, 6, 0], [81]]),
+    "puzzle_22": ("""main = do {
+    fib (addr 9) (add (addr 9) 1) read;
+    main
+}
+
+fib a b x
+    | le b x = do {
+        write b;
+        fib b (add a b) x
+    }
+    | gt b x = nop
+""", [[5, 1, 0, 10]], [[1, 1, 2, 3, 5, 1, 1, 1, 1, 2, 3, 5, 8]]),
+}
+
+# other programs with known outboxes
+edge_cases = {
+    # the extreme constants, whose signed digit chains would pass through 1000
+    "constant_999": ("""main = do {
+    a <- read;
+    write (sub a 999);
+    b <- read;
+    write (add b -999);
+    c <- read;
+    write (sub -999 c);
+    main
+    }
+""", [[998, 998, -998, 0, 0, 0]], [[-1, -1, -1, -999, -999, -999]]),
+    "constant_minus_999": ("""main = do {
+    a <- read;
+    write (add a 999);
+    b <- read;
+    write (sub b -999);
+    c <- read;
+    write (sub 999 c);
+    main
+    }
+""", [[-998, -998, 998, 0, 0, 0]], [[1, 1, 1, 999, 999, 999]]),
+}
+
+
+def nested_ifs(depth: int) -> str:
+    # a balanced tree of comparisons against thresholds in [-64, 64], a `write` at each leaf
+    def tree(lo: int, hi: int, d: int) -> str:
+        if d == 0:
+            return f"write (sub x {lo})"
+        mid = (lo + hi) // 2
+        return f"if gt x {mid} then {tree(mid, hi, d - 1)} else {tree(lo, mid, d - 1)}"
+    return f"main = do {{\n    x <- read;\n    {tree(-64, 64, depth)};\n    main\n    }}\n"
+
+
+def guard_chain(n: int) -> str:
+    guards = "\n".join(f"    | eq x {k} = write (add x {k})" for k in range(n))
+    return (f"main = do {{\n    pick read;\n    main\n    }}\n"
+            f"pick x\n{guards}\n    | gt x {n} = write x\n    | lt x 0 = write x\n")
+
+
+def tail_params(n: int) -> str:
+    # n parameters rotated on every call, the last one replaced by the sum of the first two
+    ps = [f"p{k}" for k in range(n)]
+    rotated = ps[1:] + [f"(add {ps[0]} {ps[1]})"]
+    return (f"main = do {{\n    x <- read;\n    go {' '.join(['x'] * n)} read;\n    main\n    }}\n"
+            f"go {' '.join(ps)} n\n"
+            f"    | eq n 0 = write {ps[0]}\n"
+            f"    | gt n 0 = go {' '.join(rotated)} (sub n 1)\n")
+
+
+def constants(n: int) -> str:
+    cs = [(k * 397) % 1800 - 900 for k in range(1, n + 1)]
+    writes = ";\n    ".join(f"write (add x {c})" for c in cs)
+    return f"main = do {{\n    x <- read;\n    {writes};\n    main\n    }}\n"
+
+
+# name: (generator, sizes, inbox values for a size)
+generators: Dict[str, Tuple[Callable[[int], str], List[int], Callable[[random.Random, int], List[int]]]] = {
+    "nested_ifs": (nested_ifs, [3, 6], lambda rng, n: [rng.randint(-64, 64) for _ in range(16)]),
+    "guard_chain": (guard_chain, [8, 32], lambda rng, n: [rng.randint(-3, n + 3) for _ in range(16)]),
+    "tail_params": (tail_params, [4, 8],
+                    lambda rng, n: [v for _ in range(6) for v in (rng.randint(-3, 3), rng.randint(0, 6))]),
+    "constants": (constants, [6, 24], lambda rng, n: [rng.randint(-80, 80) for _ in range(4)]),
+}
+
+
+def cases() -> List[Tuple[str, str, List[List[int]], Optional[List[List[int]]]]]:
+    # (name, source, inboxes, expected outboxes or None); synthetic inboxes are seeded by name
+    out = [(name, src, inboxes, expected) for name, (src, inboxes, expected) in {**puzzles, **edge_cases}.items()]
+    for kind, (gen, sizes, values) in generators.items():
+        for n in sizes:
+            name = f"{kind}_{n}"
+            rng = random.Random(name)
+            out.append((name, gen(n), [values(rng, n) for _ in range(4)], None))
+    return out
+
+
+def measure(source: str, inboxes: List[List[int]], optimize_for, repeat: int) -> Tuple[Dict, List]:
+    # best time of each phase over repeat compiles, the code quality and the outboxes
+    times = {p: float("inf") for p in phases}
+    for _ in range(repeat):
+        profiler = Profiler(memory=False)
+        hrm, stats = compile_source(source, optimize_for=optimize_for, profiler=profiler)
+        summary = profiler.summary()
+        for p in phases:
+            times[p] = min(times[p], summary[p]["time"])
+    floor = {t: v for v, t in const_tiles.items()}
+    outboxes = []
+    steps = 0
+    for box in inboxes:
+        try:
+            out, n, _ = simulate(hrm, box, dict(floor))
+            outboxes.append(out)
+            steps += n
+        except RuntimeError as e:
+            outboxes.append(str(e))
+    result = dict(times, instructions=stats["instructions"], tiles=len(stats["tiles"]), steps=steps,
+                  outputs=zlib.crc32(repr(outboxes).encode()))
+    return result, outboxes
+
+
+def regressions(name: str, new: Dict, old: Dict, tolerance: float, slack: float, timing: bool) -> List[str]:
+    found = []
+    if new["outputs"] != old["outputs"]:
+        found.append(f"{name}: outputs changed")
+    for k in quality:
+        if new[k] > old[k]:
+            found.append(f"{name}: {k} {old[k]} -> {new[k]}")
+    if timing:
+        for p in phases:
+            if new[p] > old[p] * (1 + tolerance) + slack:
+                found.append(f"{name}: {p} {old[p] * 1000:.2f} ms -> {new[p] * 1000:.2f} ms")
+    return found
+
+
+def main():
+    ap = argparse.ArgumentParser(description="compile time and code quality of the readme puzzles and "
+                                             "synthetic stress programs against a stored baseline")
+    ap.add_argument("-b", "--baseline", default=default_baseline)
+    ap.add_argument("-u", "--update", action="store_true", help="write the results as the new baseline")
+    ap.add_argument("-r", "--repeat", type=int, default=5, help="compiles per program, best time kept")
+    ap.add_argument("-O", "--optimize-for", type=objective, default="size")
+    ap.add_argument("--tolerance", type=float, default=1.0,
+                    help="allowed relative slowdown of a phase (default: 1.0, twice the baseline)")
+    ap.add_argument("--slack", type=float, default=0.002, help="allowed absolute slowdown in seconds")
+    ap.add_argument("--no-timing", action="store_true", help="only compare code quality and outputs")
+    args = ap.parse_args()
+
+    results = {}
+    failed = []
+    for name, source, inboxes, expected in cases():
+        result, outboxes = measure(source, inboxes, args.optimize_for, args.repeat)
+        results[name] = result
+        if expected is not None and outboxes != expected:
+            failed.append(f"{name}: expected {expected}, got {outboxes}")
+        print(f"{name:20s}" + "".join(f"{p} {result[p] * 1000:7.2f} ms  " for p in phases) +
+              f"{result['instructions']:5d} inst {result['tiles']:3d} tiles {result['steps']:7d} steps")
+
+    if args.update:
+        with open(args.baseline, "w") as f:
+            json.dump({"optimize_for": args.optimize_for, "programs": results}, f, indent=2)
+        print(f"baseline written to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["optimize_for"] != args.optimize_for:
+            raise SystemExit(f"baseline is for optimize_for={baseline['optimize_for']!r}")
+        for name, result in results.items():
+            if name in baseline["programs"]:
+                failed += regressions(name, result, baseline["programs"][name], args.tolerance, args.slack,
+                                      not args.no_timing)
+    else:
+        print(f"no baseline at {args.baseline}; run with --update to record one")
+    for f in failed:
+        print(f)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
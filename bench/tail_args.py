@@ -0,0 +1,56 @@
+import os
+import random
+import sys
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from build import compile_source, const_tiles, make_context, parse, tiles_used  # noqa: E402
+from compiler import Call  # noqa: E402
+from simulator import simulate  # noqa: E402
+from suite import tail_params  # noqa: E402
+
+# for a rotation of n parameters, the highest tile of the emitted code (x, the parameters
+# and the count, one spare tile for the cycle and the temporaries of add and sub, skipping
+# the zero tile 9) and the number of tiles once allocated
+limits = {4: (10, 6), 8: (14, 10)}
+
+
+def expected(n: int, inbox: List[int]) -> List[int]:
+    # what tail_params(n) writes: each parameter starts as x, then n rounds of rotation
+    out = []
+    for x, k in zip(inbox[::2], inbox[1::2]):
+        ps = [x] * n
+        for _ in range(k):
+            ps = ps[1:] + [ps[0] + ps[1]]
+        out.append(ps[0])
+    return out
+
+
+def check(n: int, rounds: int = 20) -> None:
+    source = tail_params(n)
+    emitted = Call("main", []).emit(make_context(parse(source)))
+    hrm, stats = compile_source(source)
+    emitted_limit, compiled_limit = limits[n]
+    if max(tiles_used(emitted)) > emitted_limit:
+        raise RuntimeError(f"{n} parameters: emitted code uses tiles {tiles_used(emitted)}")
+    if len(stats["tiles"]) > compiled_limit:
+        raise RuntimeError(f"{n} parameters: compiled code uses tiles {stats['tiles']}")
+    rng = random.Random(n)
+    floor = {t: v for v, t in const_tiles.items()}
+    for _ in range(rounds):
+        inbox = [v for _ in range(4) for v in (rng.randint(-3, 3), rng.randint(0, 6))]
+        for code in (emitted, hrm):
+            out, _, _ = simulate(code, inbox, dict(floor))
+            if out != expected(n, inbox):
+                raise RuntimeError(f"{n} parameters on {inbox}: expected {expected(n, inbox)}, got {out}")
+    print(f"{n} parameters: highest tile {max(tiles_used(emitted))} emitted, {len(stats['tiles'])} tiles compiled")
+
+
+def main():
+    for n in sorted(limits):
+        check(n)
+
+
+if __name__ == "__main__":
+    main()
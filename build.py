@@ -0,0 +1,122 @@
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import yacc
+from compiler import (Add, Addr, Call, Compare, Context, Emitter, Instrument, Nop, Read, Sub, Write,
+                      header, indirect)
+from optimizer import CostModel, Objective, PassManager, default_passes, default_triggers, instruction_count, optimize
+from profiling import Profiler, disabled
+from scan import Scanner
+from superopt import Superoptimizer
+
+# preset floor tiles, e.g. the zero tile used by `addr 9`
+reserved = [9]
+const_tiles = {0: 9}
+
+
+def builtins() -> Tuple[List[Emitter], List[Emitter]]:
+    funcs = [
+        Addr(),
+        Write(),
+        Add(), Sub(),
+        Compare("gt", False, True, False),
+        Compare("ge", True, True, False),
+        Compare("lt", False, True, True, True),
+        Compare("le", True, True, True, True),
+        Compare("eq", True, False, False, True),
+        Compare("neq", True, False, False, False)
+    ]
+    actns = [Read(), Nop()]
+    return funcs, actns
+
+
+def make_context(funcs: List[Emitter],
+                 reserved: Iterable[int] = reserved,
+                 const_tiles: Optional[Dict[int, int]] = const_tiles,
+                 const_strategy: Optional[str] = None) -> Context:
+    builtin_funcs, builtin_actns = builtins()
+    return Context(builtin_funcs, builtin_actns, funcs, reserved, const_tiles, const_strategy=const_strategy)
+
+
+def objective(text: str) -> Objective:
+    # command line form of optimize_for
+    return text if text in ("size", "speed") else float(text)
+
+
+def parse(source: str, profiler: Profiler = disabled) -> List[Emitter]:
+    lexer = Scanner()
+    with profiler.phase("lex"):
+        lexer.input(source)
+    with profiler.phase("parse"):
+        # the tokens are already scanned, so the parser is given no input to rescan
+        funcs = yacc.parser.parse(lexer=lexer)
+    if funcs is None:
+        raise ValueError("syntax error")
+    return funcs
+
+
+def format_code(hrm: List[Instrument]) -> str:
+    insts = '\n'.join(str(i) for i in hrm)
+    return f"{header}\n{insts}\n"
+
+
+def tiles_used(hrm: List[Instrument]) -> List[int]:
+    # tiles named by an instruction; an indirect access names its pointer tile
+    mask = Instrument.READS_TILE | Instrument.WRITES_TILE
+    tiles = set()
+    for i in hrm:
+        if Instrument.flags[i.code] & mask:
+            tiles.add(i.arg - indirect if i.arg >= indirect else i.arg)
+    return sorted(tiles)
+
+
+def make_manager(superopt: Optional[Superoptimizer] = None, profiler: Optional[Profiler] = None) -> PassManager:
+    # the superoptimizer runs after the default passes and again after any of them changes the code
+    if superopt is None:
+        return PassManager(profiler=profiler)
+    triggers = {f: gs + [superopt] for f, gs in default_triggers.items()}
+    return PassManager(default_passes + [superopt], triggers, profiler)
+
+
+def compile_source(source: str,
+                   reserved: Iterable[int] = reserved,
+                   const_tiles: Optional[Dict[int, int]] = const_tiles,
+                   entry: str = "main",
+                   optimize_for: Objective = "size",
+                   inbox: Optional[Sequence[int]] = None,
+                   superopt: Optional[Superoptimizer] = None,
+                   profiler: Optional[Profiler] = None) -> Tuple[List[Instrument], Dict]:
+    # besides the size pipeline, other objectives compile once per constant arithmetic
+    # strategy and keep the program the cost model likes best; rewrites the superoptimizer
+    # finds are saved to its cache file, and a profiler gets the phases and pass runs
+    reserved = list(reserved)
+    floor = {t: v for v, t in (const_tiles or {}).items()}
+    model = CostModel(optimize_for, inbox, floor)
+    prof = profiler or disabled
+    start = time.perf_counter()
+    funcs = parse(source, prof)
+    best = None
+    for strategy in [None] if model.weight == 1 else [None, "bump", "double"]:
+        with prof.phase("emit", strategy=strategy):
+            context = make_context(funcs, reserved, const_tiles, strategy)
+            hrm = Call(entry, []).emit(context)
+        manager = make_manager(superopt, profiler)
+        with prof.phase("optimize", strategy=strategy):
+            _, hrm = optimize(hrm, reserved, manager, model)
+        cost = model.cost(hrm)
+        if best is None or cost < best[0]:
+            best = cost, hrm, manager
+    _, hrm, manager = best
+    if superopt is not None:
+        superopt.save()
+    steps, measured = model.steps(hrm)
+    stats = {
+        "instructions": instruction_count(hrm),
+        "steps": steps if measured else round(steps, 1),
+        "measured": measured,
+        "tiles": tiles_used(hrm),
+        "time": time.perf_counter() - start,
+        "passes": {"runs": manager.runs, "changes": manager.changes},
+        "rules": dict(manager.rules),
+    }
+    return hrm, stats
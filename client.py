@@ -0,0 +1,101 @@
+import argparse
+import json
+import os
+import socket
+import sys
+import tempfile
+from typing import Dict, Iterable, List, Optional, Union
+
+# only the standard library is imported here, so a call costs no compiler start-up
+default_socket = os.path.join(tempfile.gettempdir(), f"nhhrm-{os.getuid()}.sock")
+objectives = ("size", "speed")
+
+
+def objective(text: str) -> Union[str, float]:
+    # build.objective without importing build
+    return text if text in objectives else float(text)
+
+
+def read_inbox(path: str) -> Optional[List[int]]:
+    # batch.read_inbox without importing batch
+    inbox = os.path.splitext(path)[0] + ".inbox"
+    if not os.path.exists(inbox):
+        return None
+    with open(inbox) as f:
+        return [int(v) for v in f.read().split()]
+
+
+class Client:
+    # keeps one connection open; requests on it are answered in order
+    def __init__(self, path: str = default_socket) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.file = self.sock.makefile("rb")
+
+    def request(self, request: Dict) -> Dict:
+        self.sock.sendall(json.dumps(request).encode() + b"\n")
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError("server closed the connection")
+        return json.loads(line)
+
+    def compile(self,
+                source: str,
+                reserved: Optional[Iterable[int]] = None,
+                const_tiles: Optional[Dict[int, int]] = None,
+                optimize_for: Optional[Union[str, float]] = None,
+                inbox: Optional[Iterable[int]] = None) -> Dict:
+        request = {"source": source}
+        if reserved is not None:
+            request["reserved"] = list(reserved)
+        if const_tiles is not None:
+            request["const_tiles"] = const_tiles
+        if optimize_for is not None:
+            request["optimize_for"] = optimize_for
+        if inbox is not None:
+            request["inbox"] = list(inbox)
+        return self.request(request)
+
+    def stats(self) -> Dict:
+        return self.request({"stats": True})
+
+    def close(self) -> None:
+        self.file.close()
+        self.sock.close()
+
+    def __enter__(self) -> "Client":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="compile sources on a running server.py")
+    ap.add_argument("files", nargs="*")
+    ap.add_argument("-s", "--socket", default=default_socket)
+    ap.add_argument("-w", "--write", action="store_true", help="write .hrm next to each source instead of printing")
+    ap.add_argument("--stats", action="store_true", help="print the server cache counters")
+    ap.add_argument("-O", "--optimize-for", type=objective, default=None,
+                    help="size, speed or a weight of size against steps in [0, 1] (default: size)")
+    args = ap.parse_args()
+    failed = 0
+    with Client(args.socket) as client:
+        for path in args.files:
+            with open(path) as f:
+                result = client.compile(f.read(), optimize_for=args.optimize_for, inbox=read_inbox(path))
+            if "error" in result:
+                print(f"{path}: {result['error']}", file=sys.stderr)
+                failed += 1
+            elif args.write:
+                with open(os.path.splitext(path)[0] + ".hrm", "w") as f:
+                    f.write(result["hrm"])
+            else:
+                sys.stdout.write(result["hrm"])
+        if args.stats:
+            print(json.dumps(client.stats()))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,52 +1,129 @@
-from typing import List, Tuple, Union
+import sys
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
 
 header = "-- HUMAN RESOURCE MACHINE PROGRAM --"
 indirect = 64
+# values a box can hold
+lower = -999
+upper = 999
 
 
 class Instrument:
-    IN = "INBOX"
-    OUT = "OUTBOX"
-    CPF = "COPYFROM"
-    CPT = "COPYTO"
-    INC = "BUMPUP"
-    DEC = "BUMPDN"
-    ADD = "ADD"
-    SUB = "SUB"
-    JMP = "JUMP"
-    JZ = "JUMPZ"
-    JN = "JUMPN"
-    LAB = "Label"
-
-    def __init__(self, code: str, arg: int = None) -> None:
+    __slots__ = ("code", "arg")
+
+    IN = 0
+    OUT = 1
+    CPF = 2
+    CPT = 3
+    INC = 4
+    DEC = 5
+    ADD = 6
+    SUB = 7
+    JMP = 8
+    JZ = 9
+    JN = 10
+    LAB = 11
+
+    names = ("INBOX", "OUTBOX", "COPYFROM", "COPYTO", "BUMPUP", "BUMPDN",
+             "ADD", "SUB", "JUMP", "JUMPZ", "JUMPN", "Label")
+
+    IS_JUMP = 1
+    IS_COPY = 2
+    READS_ACC = 4
+    WRITES_ACC = 8
+    READS_TILE = 16
+    WRITES_TILE = 32
+
+    flags = (
+        WRITES_ACC,
+        READS_ACC,
+        IS_COPY | WRITES_ACC | READS_TILE,
+        IS_COPY | READS_ACC | WRITES_TILE,
+        WRITES_ACC | READS_TILE | WRITES_TILE,
+        WRITES_ACC | READS_TILE | WRITES_TILE,
+        READS_ACC | WRITES_ACC | READS_TILE,
+        READS_ACC | WRITES_ACC | READS_TILE,
+        IS_JUMP,
+        IS_JUMP | READS_ACC,
+        IS_JUMP | READS_ACC,
+        0
+    )
+
+    def __init__(self, code: int, arg: int = None) -> None:
         self.code = code
         self.arg = arg
 
     def __repr__(self) -> str:
         pad = " " * 4
+        name = Instrument.names[self.code]
         if self.code == Instrument.LAB:
             return f"{chr(self.arg + ord('a'))}:"
         elif self.code in [Instrument.IN, Instrument.OUT]:
-            return f"{pad}{self.code}"
-        elif self.code.startswith("COPY"):
+            return f"{pad}{name}"
+        elif Instrument.flags[self.code] & Instrument.IS_COPY:
             addr = str(self.arg) if self.arg < indirect else f"[{self.arg - indirect}]"
-            return f"{pad}{self.code:9s}{addr}"
-        elif self.code.startswith("JUMP"):
-            return f"{pad}{self.code:9s}{chr(self.arg + ord('a'))}"
+            return f"{pad}{name:9s}{addr}"
+        elif Instrument.flags[self.code] & Instrument.IS_JUMP:
+            return f"{pad}{name:9s}{chr(self.arg + ord('a'))}"
         else:
-            return f"{pad}{self.code:9s}{self.arg}"
+            return f"{pad}{name:9s}{self.arg}"
+
+
+class EmitCache:
+    # least recently used inlined bodies, replayed with their labels rebased
+    def __init__(self, maxsize: int = 256) -> None:
+        self.maxsize = maxsize
+        self.entries: "OrderedDict[Tuple, Tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key: Tuple, context: "Context") -> Optional[List[Instrument]]:
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        insts, first_label, label_count, branch, costs = entry
+        offset = context.label_count - first_label
+        context.label_count += label_count
+        context.jz, context.jn, context.swap_branch = branch
+        context.const_costs.extend(costs)
+        return [Instrument(i.code, i.arg + offset)
+                if i.code == Instrument.LAB or Instrument.flags[i.code] & Instrument.IS_JUMP else i
+                for i in insts]
+
+    def store(self, key: Tuple, insts: List[Instrument], first_label: int, first_cost: int,
+              context: "Context") -> None:
+        if self.maxsize <= 0:
+            return
+        self.entries[key] = (
+            list(insts),
+            first_label,
+            context.label_count - first_label,
+            (context.jz, context.jn, context.swap_branch),
+            context.const_costs[first_cost:]
+        )
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
 
 
 class Context:
     def __init__(self,
                  builtin_funcs: List["Builtin"],
                  builtin_actns: List["Builtin"],
-                 funcs: List["Function"]) -> None:
+                 funcs: List["Function"],
+                 reserved: Iterable[int] = (),
+                 const_tiles: Dict[int, int] = None,
+                 cache_size: int = 256,
+                 const_strategy: Optional[str] = None) -> None:
         self.builtin_funcs = {f.name: f for f in builtin_funcs}
         self.builtin_actns = {a.name: a for a in builtin_actns}
         self.funcs = {f.name: f for f in funcs}
         self.vars_val: List[List[int]] = []
         self.vars_addr: List[List[int]] = []
+        self.vars_base: List[int] = []
         self.vars_name: List[List[str]] = [[]]
         self.call_chain: List[str] = []
         self.call_label: List[int] = []
@@ -54,7 +131,19 @@ class Context:
         self.jn = False
         self.swap_branch = False
         self.label_count = 0
-        self.pending_addr_offset = 0
+        self.pending_addr = 0
+        self.const_tiles = dict(const_tiles or {})
+        self.reserved = set(reserved) | set(self.const_tiles.values())
+        self.const_costs: List[Tuple[str, int, str, int, int]] = []
+        # "bump", "tile" or "double": taken where it applies instead of the shortest
+        self.const_strategy = const_strategy
+        self.emit_cache = EmitCache(cache_size)
+        # results of pure builtin calls available to the statements of the current do-block,
+        # key -> (tile, mask of operand tiles); None where code may not run straight through
+        self.values: Optional[Dict[Tuple, Tuple[int, int]]] = None
+        self.value_hits = 0
+        # fold what is constant regardless of the call site before anything is inlined
+        self.funcs = {name: f.fold(self) for name, f in self.funcs.items()}
 
     def get_next_label(self) -> int:
         label = self.label_count
@@ -62,9 +151,48 @@ class Context:
         return label
 
     def get_var_addr(self) -> int:
-        if len(self.vars_addr) == 0 or len(self.vars_addr[-1]) == 0:
-            return 0
-        return abs(self.vars_addr[-1][-1]) + 1 + self.pending_addr_offset
+        # first tile above the current frame and the arguments being prepared,
+        # skipping preset tiles
+        va = self.vars_base[-1] if len(self.vars_base) > 0 else 0
+        if len(self.vars_addr) > 0:
+            va = max([va] + [a + 1 for a in self.vars_addr[-1] if a >= 0])
+        va = max(va, self.pending_addr)
+        while va in self.reserved:
+            va += 1
+        return va
+
+    def get_temp_addr(self, after: int) -> int:
+        pending_addr = self.pending_addr
+        self.pending_addr = max(pending_addr, after + 1)
+        va = self.get_var_addr()
+        self.pending_addr = pending_addr
+        return va
+
+    def value_key(self, expr: "Emitter") -> Optional[Tuple[Tuple, int]]:
+        if self.values is None or type(expr) is not Call:
+            return None
+        return expr.value_key(self)
+
+    def value_lookup(self, key: Optional[Tuple[Tuple, int]]) -> Optional[int]:
+        if key is None or key[0] not in self.values:
+            return None
+        self.value_hits += 1
+        return self.values[key[0]][0]
+
+    def value_record(self, key: Optional[Tuple[Tuple, int]], tile: int) -> None:
+        if key is not None and self.values is not None and not key[1] >> tile & 1:
+            self.values[key[0]] = (tile, key[1])
+
+    def clobber(self, insts: List[Instrument]) -> None:
+        # forget results whose tile or operands the instructions overwrite
+        if not self.values:
+            return
+        written = 0
+        for ins in insts:
+            if Instrument.flags[ins.code] & Instrument.WRITES_TILE:
+                written |= 1 << ins.arg if ins.arg < indirect else (1 << indirect) - 1
+        if written:
+            self.values = {k: v for k, v in self.values.items() if not ((1 << v[0]) | v[1]) & written}
 
     def name_lookup(self, name: str) -> List[Instrument]:
         names = self.vars_name[-1]
@@ -97,36 +225,91 @@ class Context:
 
 
 class Emitter:
+    __slots__ = ()
+
     def emit(self, context: Context) -> List[Instrument]:
         raise NotImplementedError()
 
+    def const_value(self, context: Context) -> Optional[int]:
+        # the value left in hands, when it is known at compile time
+        return None
+
+    def truth(self, context: Context) -> Optional[bool]:
+        # the branch an if on this condition takes, when it is known at compile time
+        return None
+
+    def fold(self, context: Context) -> "Emitter":
+        return self
+
+
+class NameRef(Emitter):
+    __slots__ = ("name",)
+
+    def __init__(self, name: str) -> None:
+        self.name = sys.intern(name)
+
+    def emit(self, context: Context) -> List[Instrument]:
+        return context.name_lookup(self.name)
+
+    def const_value(self, context: Context) -> Optional[int]:
+        names = context.vars_name[-1]
+        if self.name not in names:
+            return None
+        idx = names.index(self.name)
+        return context.vars_val[-1][idx] if context.vars_addr[-1][idx] < 0 else None
+
+
+class Const(Emitter):
+    __slots__ = ("value",)
 
-class Expression(Emitter):
-    def __init__(self, emitter: Emitter) -> None:
-        self.emitter = emitter
+    def __init__(self, value: int) -> None:
+        self.value = value
 
     def emit(self, context: Context) -> List[Instrument]:
-        return self.emitter.emit(context)
+        if self.value not in context.const_tiles:
+            raise ValueError(f"constant {self.value} is not on the floor")
+        return [Instrument(Instrument.CPF, context.const_tiles[self.value])]
+
+    def const_value(self, context: Context) -> Optional[int]:
+        return self.value
 
 
 class DoBlock(Emitter):
+    __slots__ = ("exprs",)
+
     def __init__(self, exprs: List[Emitter]) -> None:
         self.exprs = exprs
 
     def emit(self, context: Context) -> List[Instrument]:
+        values = context.values
+        context.values = {}
         insts = []
         for expr in self.exprs:
             insts.extend(expr.emit(context))
+        context.values = values
+        context.clobber(insts)
         return insts
 
+    def fold(self, context: Context) -> Emitter:
+        return DoBlock([expr.fold(context) for expr in self.exprs])
+
 
 class IfBlock(Emitter):
-    def __init__(self, cond: Expression, tb: Expression, fb: Expression) -> None:
+    __slots__ = ("cond", "tb", "fb")
+
+    def __init__(self, cond: Emitter, tb: Emitter, fb: Emitter) -> None:
         self.cond = cond
         self.tb = tb
         self.fb = fb
 
     def emit(self, context: Context) -> List[Instrument]:
+        t = self.cond.truth(context)
+        if t is not None:  # the other branch can never run
+            return (self.tb if t else self.fb).emit(context)
+
+        # no value is reused across the branches or the jump back into them
+        values = context.values
+        context.values = None
         slab = context.get_next_label()
         elab = context.get_next_label()
         insts = []
@@ -141,45 +324,182 @@ class IfBlock(Emitter):
         insts.append(Instrument(Instrument.LAB, slab))
         insts.extend(b1.emit(context))
         insts.append(Instrument(Instrument.LAB, elab))
+        context.values = values
+        context.clobber(insts)
         return insts
 
+    def const_value(self, context: Context) -> Optional[int]:
+        t = self.cond.truth(context)
+        return None if t is None else (self.tb if t else self.fb).const_value(context)
+
+    def fold(self, context: Context) -> Emitter:
+        cond = self.cond.fold(context)
+        t = cond.truth(context)
+        if t is not None:
+            return (self.tb if t else self.fb).fold(context)
+        return IfBlock(cond, self.tb.fold(context), self.fb.fold(context))
+
 
 class Assignment(Emitter):
-    def __init__(self, name: str, expr: Expression) -> None:
-        self.var_name = name
+    __slots__ = ("var_name", "expr")
+
+    def __init__(self, name: str, expr: Emitter) -> None:
+        self.var_name = sys.intern(name)
         self.expr = expr
 
     def emit(self, context: Context) -> List[Instrument]:
+        c = self.expr.const_value(context)
+        if c is not None:  # bound like a constant argument, nothing to store
+            context.vars_addr[-1].append(-(context.get_var_addr() + 1))
+            context.vars_name[-1].append(self.var_name)
+            context.vars_val[-1].append(c)
+            return []
+        key = context.value_key(self.expr)
+        t = context.value_lookup(key)
+        if t is not None:  # the same value already sits on a tile
+            context.vars_addr[-1].append(t)
+            context.vars_name[-1].append(self.var_name)
+            context.vars_val[-1].append(0)
+            return []
         insts = []
         insts.extend(self.expr.emit(context))
         va = context.get_var_addr()
         insts.append(Instrument(Instrument.CPT, va))
+        context.clobber(insts[-1:])
+        context.value_record(key, va)
         context.vars_addr[-1].append(va)
         context.vars_name[-1].append(self.var_name)
         context.vars_val[-1].append(0)
         return insts
 
+    def fold(self, context: Context) -> Emitter:
+        return Assignment(self.var_name, self.expr.fold(context))
+
 
 class Guards(Emitter):
-    def __init__(self, guards: List[Tuple[Expression, Expression]]) -> None:
+    __slots__ = ("guards",)
+
+    def __init__(self, guards: List[Tuple[Emitter, Emitter]]) -> None:
         self.guards = guards
-        self.emitter = self.desugar(self.guards)
-    
-    def desugar(self, guards: List[Tuple[Expression, Expression]]) -> IfBlock:
+
+    def desugar(self, guards: List[Tuple[Emitter, Emitter]]) -> IfBlock:
         cond, expr = guards[0]
         if len(guards) == 1:
             return IfBlock(cond, expr, Nop())
         else:
-            return IfBlock(cond, expr, self.desugar(guards[1:]))
+            return IfBlock(cond, expr, Guards(guards[1:]))
 
     def emit(self, context: Context) -> List[Instrument]:
-        return self.emitter.emit(context)
+        guards = self.static(self.guards, context)
+        if len(guards) == 0:
+            return []
+        if guards[0][0].truth(context):
+            return guards[0][1].emit(context)
+        if guards is not self.guards:
+            return Guards(guards).emit(context)
+
+        n, operands = self.shared_compare(context)
+        if n < 2:
+            return self.desugar(self.guards).emit(context)
+
+        # evaluate the difference once and dispatch every guard on its sign
+        values = context.values
+        context.values = None
+        insts = self.guards[0][0].emit(context)
+        context.jz = False
+        context.jn = False
+        context.swap_branch = False
+        rest = Guards(self.guards[n:]) if n < len(self.guards) else Nop()
+        targets = []
+        for sign in range(3):  # negative, zero, positive
+            target = rest
+            for cond, expr in self.guards[:n]:
+                signs = context.builtin_funcs[cond.func_name].signs()
+                if self.operands(cond, context) != operands:
+                    signs = signs[::-1]
+                if signs[sign]:
+                    target = expr
+                    break
+            targets.append(target)
+
+        order = []
+        for t in [targets[2], targets[1], targets[0]]:
+            if all(t is not o for o in order):
+                order.append(t)
+        labels = [context.get_next_label() for _ in order]
+        elab = context.get_next_label()
+        for sign, j in [(1, Instrument.JZ), (0, Instrument.JN)]:
+            if targets[sign] is not order[0]:
+                insts.append(Instrument(j, labels[[o is targets[sign] for o in order].index(True)]))
+        for i, (t, lab) in enumerate(zip(order, labels)):
+            if i > 0:
+                insts.append(Instrument(Instrument.LAB, lab))
+            insts.extend(t.emit(context))
+            if i < len(order) - 1:
+                insts.append(Instrument(Instrument.JMP, elab))
+        insts.append(Instrument(Instrument.LAB, elab))
+        context.values = values
+        context.clobber(insts)
+        return insts
+
+    @staticmethod
+    def static(guards: List[Tuple[Emitter, Emitter]], context: Context) -> List[Tuple[Emitter, Emitter]]:
+        # drop guards known to fail and everything after the first one known to hold
+        kept = []
+        for cond, expr in guards:
+            t = cond.truth(context)
+            if t is False:
+                continue
+            kept.append((cond, expr))
+            if t:
+                break
+        return guards if len(kept) == len(guards) else kept
+
+    def fold(self, context: Context) -> Emitter:
+        guards = self.static([(cond.fold(context), expr.fold(context)) for cond, expr in self.guards], context)
+        if len(guards) == 0:
+            return Nop()
+        if guards[0][0].truth(context):
+            return guards[0][1]
+        return Guards(guards)
+
+    def shared_compare(self, context: Context) -> Tuple[int, Tuple]:
+        # number of leading guards comparing the same pair of plain operands
+        n = 0
+        operands = None
+        for cond, _ in self.guards:
+            if type(cond) is not Call or not isinstance(context.builtin_funcs.get(cond.func_name), Compare):
+                break
+            ops = self.operands(cond, context)
+            if ops is None or (operands is not None and ops != operands and ops[::-1] != operands):
+                break
+            operands = operands or ops
+            n += 1
+        return n, operands
+
+    @staticmethod
+    def operands(call: "Call", context: Context) -> Tuple:
+        if len(call.args) != 2:
+            return None
+        ops = []
+        for a in call.args:
+            if type(a) is Const:
+                ops.append(("CONST", a.value))
+            elif type(a) is NameRef and a.name in context.vars_name[-1]:
+                ops.append(("NAME", a.name))
+            else:
+                return None  # a call or an action such as read must run once per guard
+        if all(t == "CONST" for t, _ in ops):
+            return None
+        return tuple(ops)
 
 
 class Function(Emitter):
-    def __init__(self, name: str, params: List[str], body: Union[Expression, Guards]) -> None:
-        self.name = name
-        self.params = params
+    __slots__ = ("name", "params", "body")
+
+    def __init__(self, name: str, params: List[str], body: Emitter) -> None:
+        self.name = sys.intern(name)
+        self.params = [sys.intern(p) for p in params]
         self.body = body
 
     def emit(self, context: Context) -> List[Instrument]:
@@ -188,25 +508,26 @@ class Function(Emitter):
         context.vars_name.pop()
         return insts
 
+    def fold(self, context: Context) -> Emitter:
+        return Function(self.name, self.params, self.body.fold(context))
+
 
 class Call(Emitter):
-    def __init__(self, name: str, args: List) -> None:
-        self.func_name = name
+    __slots__ = ("func_name", "args")
+
+    def __init__(self, name: str, args: List[Emitter]) -> None:
+        self.func_name = sys.intern(name)
         self.args = args
 
     def emit(self, context: Context) -> List[Instrument]:
         if self.func_name in context.call_chain:
             if self.func_name == context.call_chain[-1]:
-                if len(context.funcs[self.func_name].params) > 0:
-                    insts, va, vv = self.prepare_args(context)
-                    tva = context.vars_addr[-1][:len(self.args)]
-                    assert len(va) == len(tva)
-                    for f, t in zip(va, tva):
-                        insts.append(Instrument(Instrument.CPF, f))
-                        insts.append(Instrument(Instrument.CPT, t))
-                else:
-                    insts = []
+                values = context.values
+                context.values = None  # the moves are reordered
+                insts = self.tail_args(context)
                 insts.append(Instrument(Instrument.JMP, context.call_label[-1]))
+                context.values = values
+                context.clobber(insts)
                 return insts
             else:
                 raise RecursionError(self.func_name)
@@ -214,53 +535,317 @@ class Call(Emitter):
         if self.func_name in context.builtin_actns.keys():
             return context.builtin_actns[self.func_name].emit(context)
 
+        c = self.const_value(context)
+        if c is not None:
+            return Const(c).emit(context)
+
+        base_va = context.get_var_addr()
         insts, vars_addr, vars_val = self.prepare_args(context)
+        values = context.values
+        context.values = None
         context.vars_addr.append(vars_addr)
         context.vars_val.append(vars_val)
+        context.vars_base.append(base_va)
+
+        # everything the inlined body depends on besides the label counter
+        key = (self.func_name, tuple(vars_addr), tuple(vars_val), base_va, context.pending_addr,
+               tuple(context.call_chain), context.jz, context.jn, context.swap_branch)
+        body = context.emit_cache.lookup(key, context) if self.func_name in context.funcs else None
+        if body is None:
+            first_label = context.label_count
+            first_cost = len(context.const_costs)
 
-        context.call_chain.append(self.func_name)
-        call_label = context.get_next_label()
-        context.call_label.append(call_label)
+            context.call_chain.append(self.func_name)
+            call_label = context.get_next_label()
+            context.call_label.append(call_label)
 
-        insts.append(Instrument(Instrument.LAB, call_label))
-        insts.extend(context.func_lookup(self.func_name))
+            body = [Instrument(Instrument.LAB, call_label)]
+            body.extend(context.func_lookup(self.func_name))
 
+            context.call_label.pop()
+            context.call_chain.pop()
+
+            if self.func_name in context.funcs:
+                context.emit_cache.store(key, body, first_label, first_cost, context)
+        insts.extend(body)
+
+        context.vars_base.pop()
         context.vars_val.pop()
         context.vars_addr.pop()
+        context.values = values
+        context.clobber(body)
 
-        context.call_label.pop()
-        context.call_chain.pop()
+        return insts
+
+    def const_value(self, context: Context) -> Optional[int]:
+        f = context.builtin_funcs.get(self.func_name)
+        if f is None:
+            return None
+        values = []
+        for a in self.args:
+            v = a.const_value(context)
+            if v is None:
+                return None
+            values.append(v)
+        return f.evaluate(values)
+
+    def value_key(self, context: Context) -> Optional[Tuple[Tuple, int]]:
+        # a pure builtin call named by its operands' tiles and constants,
+        # with the mask of the tiles it reads
+        f = context.builtin_funcs.get(self.func_name)
+        if f is None or not f.pure:
+            return None
+        names = context.vars_name[-1]
+        ops = []
+        deps = 0
+        for a in self.args:
+            c = a.const_value(context)
+            if c is not None:
+                ops.append(("const", c))
+            elif type(a) is NameRef and a.name in names:
+                t = context.vars_addr[-1][names.index(a.name)]
+                ops.append(("tile", t))
+                deps |= 1 << t
+            elif type(a) is Call and a.value_key(context) is not None:
+                key, mask = a.value_key(context)
+                ops.append(key)
+                deps |= mask
+            else:
+                return None
+        if f.commutative:
+            ops.sort()
+        return (self.func_name, tuple(ops)), deps
+
+    def truth(self, context: Context) -> Optional[bool]:
+        f = context.builtin_funcs.get(self.func_name)
+        if not isinstance(f, Compare):
+            return None
+        d = self.const_value(context)
+        return None if d is None else f.holds(d)
+
+    def fold(self, context: Context) -> Emitter:
+        args = []
+        for a in self.args:
+            a = a.fold(context)
+            c = a.const_value(context)
+            args.append(a if c is None or type(a) is Const else Const(c))
+        return Call(self.func_name, args)
+
+    def tail_args(self, context: Context) -> List[Instrument]:
+        # move the new arguments onto the parameter tiles as one parallel move:
+        # identity moves are skipped, values go straight to their tile once no
+        # pending argument reads it, and a cycle is broken through a spare tile
+        params = context.funcs[self.func_name].params
+        if len(params) != len(self.args):
+            raise ValueError(f"'{self.func_name}' accepts {len(params)} args")
+        names = context.vars_name[-1]
+        frame_addr = context.vars_addr[-1]
+        frame_val = context.vars_val[-1]
+
+        moves = []  # [target, code, tiles read, has side effect]
+        for a, t, v in zip(self.args, frame_addr, frame_val):
+            if type(a) is NameRef and a.name in names:
+                idx = names.index(a.name)
+                s = frame_addr[idx]
+                if s == t:
+                    continue
+                if s >= 0:
+                    if t >= 0:
+                        moves.append([t, [Instrument(Instrument.CPF, s)], 1 << s, False])
+                        continue
+                    raise ValueError(f"'{self.func_name}' changes constant argument")
+                c = frame_val[idx]
+            else:
+                c = a.const_value(context)
+                if c is None:
+                    moves.append([t, a, 0, True])
+                    continue
+            # a constant argument
+            if t < 0 and c == v:
+                continue
+            if t < 0 or c not in context.const_tiles:
+                raise ValueError(f"'{self.func_name}' changes constant argument")
+            moves.append([t, [Instrument(Instrument.CPF, context.const_tiles[c])], 0, False])
+        if any(t < 0 for t, _, _, _ in moves):
+            raise ValueError(f"'{self.func_name}' changes constant argument")
+
+        # one spare tile for breaking cycles, below every temporary the arguments use
+        pending_addr = context.pending_addr
+        spare = []
+        if len(moves) > 1:
+            spare.append(context.get_var_addr())
+            context.pending_addr = spare[0] + 1
+        every_tile = (1 << indirect) - 1
+        high = context.pending_addr
+        for m in moves:
+            if isinstance(m[1], list):
+                continue
+            code = m[1].emit(context)
+            m[1] = code
+            m[3] = False
+            for ins in code:
+                f = Instrument.flags[ins.code]
+                if f & Instrument.READS_TILE:
+                    m[2] |= 1 << ins.arg if ins.arg < indirect else every_tile
+                if f & (Instrument.READS_TILE | Instrument.WRITES_TILE) and ins.arg < indirect:
+                    high = max(high, ins.arg + 1)
+                if ins.code in [Instrument.IN, Instrument.OUT]:
+                    m[3] = True
 
+        insts = []
+        spilled = []  # [move, its spare tile]
+        while len(moves) > 0:
+            # side effects keep their order
+            first_effect = next((m for m in moves if m[3]), None)
+            ready = [m for m in moves if not m[3] or m is first_effect]
+            for m in ready:
+                if all(o is m or not o[2] >> m[0] & 1 for o in moves):
+                    insts.extend(m[1])
+                    insts.append(Instrument(Instrument.CPT, m[0]))
+                    moves.remove(m)
+                    # its spare tile is free again once the spilled value is in place
+                    spare += [t for s, t in spilled if s is m]
+                    break
+            else:
+                # a spilled move only reads its spare tile, so spilling it again frees nothing;
+                # each move is spilled at most once, preferring the one that reads the most other
+                # targets, as it may close several cycles
+                targets = 0
+                for o in moves:
+                    targets |= 1 << o[0]
+                fresh = [m for m in ready if all(m is not s for s, _ in spilled)]
+                m = max(fresh, key=lambda m: bin(m[2] & targets & ~(1 << m[0])).count("1"))
+                if len(spare) == 0:
+                    # cycles sharing a move may need a second tile, above every temporary
+                    context.pending_addr = high
+                    spare.append(context.get_var_addr())
+                    high = spare[0] + 1
+                t = spare.pop(0)
+                spilled.append([m, t])
+                insts.extend(m[1])
+                insts.append(Instrument(Instrument.CPT, t))
+                m[1:] = [[Instrument(Instrument.CPF, t)], 1 << t, False]
+        context.pending_addr = pending_addr
         return insts
 
     def prepare_args(self, context: Context):
-        base_va = context.get_var_addr()
-        local_va = 0
+        pending_addr = context.pending_addr
         insts = []
         vars_addr = []
         vars_val = []
         for a in self.args:
-            va = base_va + local_va
-            local_va += 1
-            context.pending_addr_offset = local_va
-            if isinstance(a, Emitter):
-                insts.extend(a.emit(context))
-                insts.append(Instrument(Instrument.CPT, va))
-                vars_addr.append(va)
-                vars_val.append(None)
-            elif a["type"] == "NAME":
-                insts.extend(context.name_lookup(a["value"]))
-                insts.append(Instrument(Instrument.CPT, va))
-                vars_addr.append(va)
-                vars_val.append(0)
-            else:  # a["type"] == "CONST"
+            va = context.get_var_addr()
+            c = a.const_value(context)
+            if c is not None:  # propagated into the callee as a constant argument
                 vars_addr.append(-(va + 1))
-                vars_val.append(int(a["value"]))
-        context.pending_addr_offset = 0
+                vars_val.append(c)
+                continue
+            key = context.value_key(a)
+            t = context.value_lookup(key)
+            if t is not None and self.func_name in context.builtin_funcs:
+                # builtins never write their argument tiles, so read it in place
+                context.pending_addr = max(context.pending_addr, t + 1)
+                vars_addr.append(t)
+                vars_val.append(None)
+                continue
+            context.pending_addr = va + 1
+            insts.extend([Instrument(Instrument.CPF, t)] if t is not None else a.emit(context))
+            insts.append(Instrument(Instrument.CPT, va))
+            context.clobber(insts[-1:])
+            context.value_record(key, va)
+            vars_addr.append(va)
+            vars_val.append(0 if type(a) is NameRef else None)
+        context.pending_addr = pending_addr
         return insts, vars_addr, vars_val
 
 
+def binary_digits(n: int) -> List[int]:
+    return [int(b) for b in bin(n)[2:]]
+
+
+def signed_digits(n: int) -> List[int]:
+    # non-adjacent form, most significant digit first
+    digits = []
+    while n > 0:
+        d = 2 - n % 4 if n % 2 else 0
+        digits.append(d)
+        n = (n - d) // 2
+    return digits[::-1]
+
+
+def const_arith(context: Context, name: str, v: int, c: int, va: int, negate: bool = False) -> List[Instrument]:
+    # va <- v + c, or c - v when negate, leaving the result in hands;
+    # picks the cheapest of a BUMP chain, building c by doubling and a preset constant tile
+    tiles = context.const_tiles
+    step = Instrument.INC if c > 0 else Instrument.DEC
+    candidates = []
+
+    if negate:
+        if 0 in tiles:
+            head = [Instrument(Instrument.CPF, tiles[0]), Instrument(Instrument.SUB, v), Instrument(Instrument.CPT, va)]
+        else:
+            head = [
+                Instrument(Instrument.CPF, v),
+                Instrument(Instrument.CPT, va),
+                Instrument(Instrument.SUB, va),
+                Instrument(Instrument.SUB, va),
+                Instrument(Instrument.CPT, va)
+            ]
+    else:
+        head = [Instrument(Instrument.CPF, v), Instrument(Instrument.CPT, va)]
+    candidates.append(("bump", head + [Instrument(step, va)] * abs(c)))
+
+    if negate and c in tiles:
+        candidates.append(("tile", [
+            Instrument(Instrument.CPF, tiles[c]),
+            Instrument(Instrument.SUB, v),
+            Instrument(Instrument.CPT, va)
+        ]))
+    elif not negate and (c in tiles or -c in tiles):
+        candidates.append(("tile", [
+            Instrument(Instrument.CPF, v),
+            Instrument(Instrument.ADD, tiles[c]) if c in tiles else Instrument(Instrument.SUB, tiles[-c]),
+            Instrument(Instrument.CPT, va)
+        ]))
+
+    if abs(c) > 1:
+        t = context.get_temp_addr(va)
+        if 0 in tiles:
+            zero = [Instrument(Instrument.CPF, tiles[0]), Instrument(Instrument.CPT, t)]
+        else:
+            zero = [Instrument(Instrument.CPF, v), Instrument(Instrument.SUB, v), Instrument(Instrument.CPT, t)]
+        if negate:
+            tail = [Instrument(Instrument.SUB, v), Instrument(Instrument.CPT, va)]
+        else:
+            tail = [Instrument(Instrument.CPF, v), Instrument(Instrument.ADD, t), Instrument(Instrument.CPT, va)]
+        for digits in [binary_digits(abs(c)), signed_digits(abs(c))]:
+            insts = zero.copy()
+            values = []  # what t holds after each step, up to the sign of c
+            for i, d in enumerate(digits):
+                if i > 0:
+                    insts.extend([Instrument(Instrument.ADD, t), Instrument(Instrument.CPT, t)])
+                    values.append(2 * values[-1])
+                if d != 0:
+                    insts.append(Instrument(Instrument.INC if (d > 0) == (c > 0) else Instrument.DEC, t))
+                    values.append((values[-1] if values else 0) + d)
+            # a signed digit chain can overshoot, e.g. 999 = 1000 - 1 passes through 1000
+            fits = all(lower <= v <= upper for v in values)
+            if fits:
+                candidates.append(("double", insts + tail))
+
+    # straight-line code: every instruction is executed exactly once, so size and steps agree
+    # here; what a strategy costs after optimization is left to the caller's cost model
+    preferred = [sc for sc in candidates if sc[0] == context.const_strategy]
+    strategy, insts = min(preferred or candidates, key=lambda sc: len(sc[1]))
+    context.const_costs.append((name, c, strategy, len(insts), len(insts)))
+    return insts
+
+
 class Builtin(Emitter):
+    # pure: the result depends only on the arguments and nothing but temporaries is written
+    pure = False
+    commutative = False
+
     def __init__(self, name: str) -> None:
         super().__init__()
         self.name = name
@@ -268,6 +853,10 @@ class Builtin(Emitter):
     def emit(self, context: Context) -> List[Instrument]:
         raise NotImplementedError()
 
+    def evaluate(self, values: List[int]) -> Optional[int]:
+        # the result for constant arguments, if it can be computed at compile time
+        return None
+
 
 class Nop(Builtin):
     def __init__(self) -> None:
@@ -319,9 +908,15 @@ class Write(Builtin):
 
 
 class Add(Builtin):
+    pure = True
+    commutative = True
+
     def __init__(self) -> None:
         super().__init__("add")
 
+    def evaluate(self, values: List[int]) -> Optional[int]:
+        return values[0] + values[1] if len(values) == 2 else None
+
     def emit(self, context: Context) -> List[Instrument]:
         vars_addr = context.vars_addr[-1]
         if len(vars_addr) != 2:
@@ -334,12 +929,7 @@ class Add(Builtin):
                 v0c = vars_addr[0] < 0
                 v = vars_addr[1 if v0c else 0]
                 c = context.vars_val[-1][0 if v0c else 1]
-                ins = Instrument.INC if c > 0 else Instrument.DEC
-                return [
-                    Instrument(Instrument.CPF, v),
-                    Instrument(Instrument.CPT, va),
-                    *([Instrument(ins, va)] * abs(c))
-                ]
+                return const_arith(context, self.name, v, c, va)
         else:  # two addr
             return [
                 Instrument(Instrument.CPF, vars_addr[0]),
@@ -350,9 +940,14 @@ class Add(Builtin):
 
 
 class Sub(Builtin):
+    pure = True
+
     def __init__(self) -> None:
         super().__init__("sub")
 
+    def evaluate(self, values: List[int]) -> Optional[int]:
+        return values[0] - values[1] if len(values) == 2 else None
+
     def emit(self, context: Context) -> List[Instrument]:
         vars_addr = context.vars_addr[-1]
         if len(vars_addr) != 2:
@@ -366,22 +961,9 @@ class Sub(Builtin):
                 v = vars_addr[1 if v0c else 0]
                 c = context.vars_val[-1][0 if v0c else 1]
                 if v0c:  # const - v
-                    ins = Instrument.INC if c > 0 else Instrument.DEC
-                    return [
-                        Instrument(Instrument.CPF, v),
-                        Instrument(Instrument.CPT, va),
-                        Instrument(Instrument.SUB, va),
-                        Instrument(Instrument.SUB, va),
-                        Instrument(Instrument.CPT, va),
-                        *([Instrument(ins, va)] * abs(c))
-                    ]
+                    return const_arith(context, self.name, v, c, va, negate=True)
                 else:  # v - const
-                    ins = Instrument.DEC if c > 0 else Instrument.INC
-                    return [
-                        Instrument(Instrument.CPF, v),
-                        Instrument(Instrument.CPT, va),
-                        *([Instrument(ins, va)] * abs(c))
-                    ]
+                    return const_arith(context, self.name, v, -c, va)
         else:  # two addr
             v0, v1 = vars_addr
             return [
@@ -430,3 +1012,17 @@ class Compare(Builtin):
         context.swap_branch = self.swap_branch
 
         return insts
+
+    def signs(self) -> Tuple[bool, bool, bool]:
+        # (negative, zero, positive) differences of the operands the comparison holds for,
+        # matching the jumps IfBlock emits for it
+        jz, jn = (self.jz, self.jn) if self.jz or self.jn else (True, True)
+        taken = (jn, jz, False)
+        return taken if self.swap_branch else tuple(not t for t in taken)
+
+    def evaluate(self, values: List[int]) -> Optional[int]:
+        # hands hold the difference, like after emit
+        return values[0] - values[1] if len(values) == 2 else None
+
+    def holds(self, d: int) -> bool:
+        return self.signs()[(d > 0) - (d < 0) + 1]
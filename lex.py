@@ -1,3 +1,5 @@
+import os
+
 import ply.lex as lex
 
 literals = "|=;(){}"
@@ -44,4 +46,18 @@ def t_error(t):
     t.lexer.skip(1)
 
 
-lexer = lex.lex()
+_lexer = None
+
+
+def get_lexer() -> lex.Lexer:
+    # built on first use from lextab.py next to this file
+    global _lexer
+    if _lexer is None:
+        _lexer = lex.lex(optimize=True, lextab="lextab", outputdir=os.path.dirname(os.path.abspath(__file__)))
+    return _lexer
+
+
+def __getattr__(name: str):
+    if name == "lexer":
+        return get_lexer()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,10 @@
+# lextab.py. This file automatically created by PLY (version 3.11). Don't edit!
+_tabversion   = '3.10'
+_lextokens    = set(('ASSIGN', 'CONST', 'DO', 'ELSE', 'IF', 'NAME', 'THEN'))
+_lexreflags   = 64
+_lexliterals  = '|=;(){}'
+_lexstateinfo = {'INITIAL': 'inclusive'}
+_lexstatere   = {'INITIAL': [('(?P<t_NAME>[a-z][_0-9A-Za-z]*)|(?P<t_CONST>-?\\d+)|(?P<t_newline>\\n+)|(?P<t_ASSIGN><-)', [None, ('t_NAME', 'NAME'), ('t_CONST', 'CONST'), ('t_newline', 'newline'), (None, 'ASSIGN')])]}
+_lexstateignore = {'INITIAL': ' \t'}
+_lexstateerrorf = {'INITIAL': 't_error'}
+_lexstateeoff = {}
@@ -1,95 +1,947 @@
-from typing import List, Tuple
-from bisect import bisect_right
-from compiler import Instrument
-
-
-def optimize(hrm: List[Instrument]) -> Tuple[bool, List[Instrument]]:
-    os = [
-        o_redundant_copy,
-        o_continuous_label,
-        o_immediate_jump,
-        o_unref_label,
-        o_dead_code,
-        remap_labels
-    ]
-    optimized = False
-    for f in os:
-        r, hrm = f(hrm)
-        optimized = optimized or r
-    return optimized, hrm
-
-
-def o_redundant_copy(hrm: List[Instrument]) -> Tuple[bool, List[Instrument]]:
-    opt = []
-    i = 0
-    while i < len(hrm):
-        opt.append(hrm[i])
-        if hrm[i].code.startswith("COPY"):
-            j = i + 1
-            while j < len(hrm) and hrm[j].code.startswith("COPY") and hrm[j].arg == hrm[i].arg:
-                j += 1
-            i = j
-        else:
-            i += 1
-    return len(opt) < len(hrm), opt
+from collections import deque
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+from compiler import Instrument, indirect
+from peephole import Peephole, rules
+from simulator import simulate
+
+flags = Instrument.flags
+all_tiles = (1 << indirect) - 1
+peephole = Peephole(rules)
+
+Pass = Callable[[List[Instrument]], Tuple[bool, List[Instrument]]]
+# "size", "speed", or the weight of the instruction count against the step count
+Objective = Union[str, float]
+
+
+def optimize(hrm: List[Instrument],
+             reserved: Iterable[int] = (),
+             manager: Optional["PassManager"] = None,
+             model: Optional["CostModel"] = None) -> Tuple[bool, List[Instrument]]:
+    # pass a manager to read its runs/changes counters afterwards;
+    # a model that weighs steps lets the code grow where that saves steps
+    manager = manager or PassManager()
+    hrm = manager.run(hrm)
+    r, hrm = manager.apply(allocate_tiles, hrm, reserved)
+    if r:
+        hrm = manager.run(hrm)
+    if model is not None:
+        _, hrm = manager.apply(reorder_blocks, hrm, model, manager)
+    if model is not None and model.weight < 1:
+        r, hrm = manager.apply(duplicate_tails, hrm, model, manager)
+        if r:
+            r, hrm = manager.apply(allocate_tiles, hrm, reserved)
+            if r:
+                hrm = manager.run(hrm)
+    return manager.changed, hrm
+
+
+def instruction_count(hrm: List[Instrument]) -> int:
+    return sum(1 for i in hrm if i.code != Instrument.LAB)
+
+
+def o_peephole(hrm: List[Instrument], hits: Optional[Dict[str, int]] = None) -> Tuple[bool, List[Instrument]]:
+    # local rewrites declared in peephole.rules; a PassManager counts their hits in its rules
+    return peephole(hrm, hits)
 
 
 def o_unref_label(hrm: List[Instrument]) -> Tuple[bool, List[Instrument]]:
-    labs = set(i.arg for i in hrm if i.code == Instrument.LAB)
-    jmps = set(i.arg for i in hrm if i.code.startswith("JUMP"))
-    unrefs = labs.difference(jmps)
-    opt = [i for i in hrm if i.code != Instrument.LAB or i.arg not in unrefs]
-    return len(unrefs) > 0, opt
+    jmps = set(i.arg for i in hrm if flags[i.code] & Instrument.IS_JUMP)
+    opt = [i for i in hrm if i.code != Instrument.LAB or i.arg in jmps]
+    return len(opt) < len(hrm), opt
 
 
 def o_continuous_label(hrm: List[Instrument]) -> Tuple[bool, List[Instrument]]:
-    glabs = []
-    i = 0
-    while i < len(hrm):
-        g = []
-        while hrm[i].code == Instrument.LAB:
-            g.append(hrm[i].arg)
-            i += 1
-        if len(g) > 1:
-            glabs.append(g)
-        i += 1
-    opt = hrm.copy()
-    for g in glabs:
-        if len(g) > 1:
-            t = g[0]
-            opt = [
-                (Instrument(ins.code, t) if (ins.code.startswith("JUMP") and ins.arg in g[1:]) else ins)
-                for ins in opt]
-    return len(glabs) > 0, opt
+    target = {}
+    head = None
+    for ins in hrm:
+        if ins.code == Instrument.LAB:
+            if head is None:
+                head = ins.arg
+            else:
+                target[ins.arg] = head
+        else:
+            head = None
+    return retarget(hrm, target)
 
 
 def o_dead_code(hrm: List[Instrument]) -> Tuple[bool, List[Instrument]]:
-    ijmp = [i for i in range(len(hrm)) if hrm[i].code == Instrument.JMP]
-    ilab = [i for i in range(len(hrm)) if hrm[i].code == Instrument.LAB]
+    opt = []
+    dead = False
+    for ins in hrm:
+        if ins.code == Instrument.LAB:
+            dead = False
+        if not dead:
+            opt.append(ins)
+        if ins.code == Instrument.JMP:
+            dead = True
+    return len(opt) < len(hrm), opt
 
-    if len(ijmp) == 0:
+
+def o_immediate_jump(hrm: List[Instrument]) -> Tuple[bool, List[Instrument]]:
+    ij = {hrm[i].arg: hrm[i + 1].arg for i in range(len(hrm) - 1)
+          if hrm[i].code == Instrument.LAB and hrm[i + 1].code == Instrument.JMP}
+    target = {}
+    for lab in ij:
+        # follow the chain of label-jumps, stopping at the first revisited label
+        seen = {lab}
+        t = ij[lab]
+        while t in ij and t not in seen:
+            seen.add(t)
+            t = ij[t]
+        if t != lab:
+            target[lab] = t
+    return retarget(hrm, target)
+
+
+def retarget(hrm: List[Instrument], target: Dict[int, int]) -> Tuple[bool, List[Instrument]]:
+    if len(target) == 0:
         return False, hrm
+    opt = [Instrument(ins.code, target[ins.arg])
+           if flags[ins.code] & Instrument.IS_JUMP and ins.arg in target else ins
+           for ins in hrm]
+    return any(a is not b for a, b in zip(opt, hrm)), opt
 
-    ilab.append(len(hrm))
-    secs = [(j + 1, ilab[bisect_right(ilab, j)]) for j in ijmp]
-    secs = [(i, j) for i, j in secs if j - i > 0]
-    secs.reverse()
-    opt = hrm.copy()
-    for l, r in secs:
-        for _ in range(r - l):
-            opt.pop(l)
 
-    return len(secs) > 0, opt
+def o_dead_store(hrm: List[Instrument]) -> Tuple[bool, List[Instrument]]:
+    blocks = build_cfg(hrm)
+    _, live_out = liveness(hrm, blocks)
+    dead = set()
+    for b, out in zip(blocks, live_out):
+        live = out
+        for i in range(b.end - 1, b.start - 1, -1):
+            ins = hrm[i]
+            if ins.code == Instrument.CPT and ins.arg < indirect and not live >> ins.arg & 1:
+                dead.add(i)
+            else:
+                live = transfer(ins, live)
+    if len(dead) == 0:
+        return False, hrm
+    return True, [ins for i, ins in enumerate(hrm) if i not in dead]
 
 
-def o_immediate_jump(hrm: List[Instrument]) -> Tuple[bool, List[Instrument]]:
-    ij = [(hrm[i].arg, hrm[i + 1].arg) for i in range(len(hrm) - 1)
-          if hrm[i].code == Instrument.LAB and hrm[i + 1].code == Instrument.JMP]
-    opt = hrm.copy()
-    for i, j in ij:
-        opt = [Instrument(ins.code, j) if (ins.code.startswith("JUMP") and ins.arg == i) else ins
-               for ins in hrm]
-    return len(ij) > 0, opt
+class Block:
+    # succs lists the jump target first, then the fall-through block
+    __slots__ = ("start", "end", "succs", "preds")
+
+    def __init__(self, start: int, end: int) -> None:
+        self.start = start
+        self.end = end
+        self.succs: List[int] = []
+        self.preds: List[int] = []
+
+
+def build_cfg(hrm: List[Instrument]) -> List[Block]:
+    leaders = {0}
+    for i, ins in enumerate(hrm):
+        if ins.code == Instrument.LAB:
+            leaders.add(i)
+        elif flags[ins.code] & Instrument.IS_JUMP:
+            leaders.add(i + 1)
+    leaders = sorted(l for l in leaders if l < len(hrm))
+    blocks = [Block(s, e) for s, e in zip(leaders, leaders[1:] + [len(hrm)])]
+    block_of = {hrm[b.start].arg: n for n, b in enumerate(blocks) if hrm[b.start].code == Instrument.LAB}
+    for n, b in enumerate(blocks):
+        last = hrm[b.end - 1]
+        if flags[last.code] & Instrument.IS_JUMP:
+            b.succs.append(block_of[last.arg])
+        if last.code != Instrument.JMP and n + 1 < len(blocks):
+            b.succs.append(n + 1)
+        for s in b.succs:
+            blocks[s].preds.append(n)
+    return blocks
+
+
+def transfer(ins: Instrument, live: int, alias: bool = True) -> int:
+    # tiles live before ins given the tiles live after it
+    f = flags[ins.code]
+    if not f & (Instrument.READS_TILE | Instrument.WRITES_TILE):
+        return live
+    if ins.arg >= indirect:
+        # the pointer tile is read, the tile it points to may be any
+        live |= 1 << (ins.arg - indirect)
+        return live | all_tiles if alias and f & Instrument.READS_TILE else live
+    if ins.code == Instrument.CPT:
+        return live & ~(1 << ins.arg)
+    return live | 1 << ins.arg
+
+
+def liveness(hrm: List[Instrument], blocks: List[Block], alias: bool = True) -> Tuple[List[int], List[int]]:
+    live_in = [0] * len(blocks)
+    live_out = [0] * len(blocks)
+    work = deque(reversed(range(len(blocks))))
+    queued = set(work)
+    while work:
+        n = work.popleft()
+        queued.discard(n)
+        b = blocks[n]
+        live = 0
+        for s in b.succs:
+            live |= live_in[s]
+        live_out[n] = live
+        for i in range(b.end - 1, b.start - 1, -1):
+            live = transfer(hrm[i], live, alias)
+        if live != live_in[n]:
+            live_in[n] = live
+            for p in b.preds:
+                if p not in queued:
+                    work.append(p)
+                    queued.add(p)
+    return live_in, live_out
+
+
+def allocate_tiles(hrm: List[Instrument], reserved: Iterable[int] = ()) -> Tuple[bool, List[Instrument]]:
+    blocks = build_cfg(hrm)
+    if len(blocks) == 0:
+        return False, hrm
+    # tiles read through pointers are data the program never names: they are
+    # preset, so exact liveness treats indirect reads as reading the pointer only
+    live_in, live_out = liveness(hrm, blocks, alias=False)
+    fixed = live_in[0]
+    for t in reserved:
+        fixed |= 1 << t
+
+    used = 0
+    has_indirect = False
+    order = []
+    for ins in hrm:
+        if flags[ins.code] & (Instrument.READS_TILE | Instrument.WRITES_TILE):
+            t = ins.arg
+            if t >= indirect:
+                has_indirect = True
+                t -= indirect
+            if not used >> t & 1:
+                used |= 1 << t
+                order.append(t)
+
+    interfere = [0] * indirect
+    hint: Dict[int, int] = {}
+    for b, out in zip(blocks, live_out):
+        live = out
+        for i in range(b.end - 1, b.start - 1, -1):
+            ins = hrm[i]
+            if flags[ins.code] & Instrument.WRITES_TILE and ins.arg < indirect:
+                d = ins.arg
+                others = live & ~(1 << d)
+                if ins.code == Instrument.CPT and i > b.start \
+                        and hrm[i - 1].code == Instrument.CPF and hrm[i - 1].arg < indirect:
+                    # COPYFROM s; COPYTO d leaves d and s equal, try to merge them
+                    s = hrm[i - 1].arg
+                    others &= ~(1 << s)
+                    hint.setdefault(d, s)
+                interfere[d] |= others
+            live = transfer(ins, live, False)
+    # made symmetric once, rather than for each write
+    for d in range(indirect):
+        for t in range(indirect):
+            if interfere[d] >> t & 1:
+                interfere[t] |= 1 << d
+
+    # with pointers around, tiles the program does not already use may hold data
+    pool = used if has_indirect else all_tiles
+    pool &= ~fixed
+    color = {t: t for t in range(indirect) if fixed >> t & 1}
+    for t in order:
+        if t in color:
+            continue
+        taken = 0
+        for u, c in color.items():
+            if interfere[t] >> u & 1:
+                taken |= 1 << c
+        free = pool & ~taken
+        s = hint.get(t)
+        if s is not None and s in color and free >> color[s] & 1:
+            color[t] = color[s]
+        elif free:
+            color[t] = (free & -free).bit_length() - 1
+        else:
+            raise ValueError(f"no free tile for tile {t}")
+
+    if all(c == t for t, c in color.items()):
+        return False, hrm
+    opt = []
+    for ins in hrm:
+        if flags[ins.code] & (Instrument.READS_TILE | Instrument.WRITES_TILE):
+            if ins.arg >= indirect:
+                opt.append(Instrument(ins.code, color[ins.arg - indirect] + indirect))
+            else:
+                opt.append(Instrument(ins.code, color[ins.arg]))
+        else:
+            opt.append(ins)
+    return True, opt
+
+
+# what the hands are known to hold: the tiles (bit t) and pointer reads
+# (bit indirect + p) equal to it, its value if constant, and constant tiles
+AccState = Tuple[int, Optional[int], Dict[int, int]]
+unknown: AccState = (0, None, {})
+pointer_reads = all_tiles << indirect
+
+
+def acc_transfer(ins: Instrument, state: AccState) -> AccState:
+    # updates the constant tiles of state in place, so callers hand in a copy of their own
+    eq, const, consts = state
+    code, a = ins.code, ins.arg
+    if code in [Instrument.IN, Instrument.OUT]:
+        consts.clear()
+        return 0, None, consts
+    if code == Instrument.CPF:
+        if a >= indirect:
+            return 1 << a, None, consts
+        return 1 << a, consts.get(a), consts
+    if code == Instrument.CPT:
+        if a >= indirect:
+            # the pointer may point at itself and move, so [p] may name another tile after;
+            # every tile still equal to the hands stays so, written or not
+            for t in [t for t, v in consts.items() if const is None or v != const]:
+                del consts[t]
+            return eq & all_tiles, const, consts
+        if const is None:
+            consts.pop(a, None)
+        else:
+            consts[a] = const
+        return eq & all_tiles | 1 << a, const, consts
+    if code in [Instrument.INC, Instrument.DEC]:
+        if a >= indirect:
+            consts.clear()
+            return 0, None, consts
+        v = consts.pop(a, None)
+        if v is not None:
+            v += 1 if code == Instrument.INC else -1
+            consts[a] = v
+        return 1 << a, v, consts
+    if code in [Instrument.ADD, Instrument.SUB]:
+        v = consts.get(a) if a < indirect else None
+        if const is None or v is None:
+            return 0, None, consts
+        return 0, const + v if code == Instrument.ADD else const - v, consts
+    return state
+
+
+def acc_merge(a: Optional[AccState], b: AccState) -> AccState:
+    if a is None:
+        return b
+    consts = {t: v for t, v in a[2].items() if b[2].get(t) == v}
+    return a[0] & b[0], a[1] if a[1] == b[1] else None, consts
+
+
+def acc_redundant(ins: Instrument, state: AccState) -> bool:
+    eq, const, consts = state
+    if ins.code not in [Instrument.CPF, Instrument.CPT]:
+        return False
+    if eq >> ins.arg & 1:
+        return True
+    return const is not None and ins.arg < indirect and consts.get(ins.arg) == const
+
+
+def o_acc_value(hrm: List[Instrument]) -> Tuple[bool, List[Instrument]]:
+    blocks = build_cfg(hrm)
+    if len(blocks) == 0:
+        return False, hrm
+    state_in: List[Optional[AccState]] = [None] * len(blocks)
+    state_in[0] = unknown
+    work = deque([0])
+    queued = {0}
+    while work:
+        n = work.popleft()
+        queued.discard(n)
+        b = blocks[n]
+        eq, const, consts = state_in[n]
+        state = eq, const, dict(consts)
+        for i in range(b.start, b.end):
+            state = acc_transfer(hrm[i], state)
+        last = hrm[b.end - 1]
+        for k, s in enumerate(b.succs):
+            out = state
+            if k == 0 and last.code == Instrument.JZ:
+                # the hands hold zero on the taken edge
+                out = (state[0], 0, state[2])
+            merged = acc_merge(state_in[s], out)
+            if merged != state_in[s]:
+                state_in[s] = merged
+                if s not in queued:
+                    work.append(s)
+                    queued.add(s)
+
+    dead = set()
+    for n, b in enumerate(blocks):
+        if state_in[n] is None:
+            continue
+        eq, const, consts = state_in[n]
+        state = eq, const, dict(consts)
+        load = None
+        for i in range(b.start, b.end):
+            ins = hrm[i]
+            f = flags[ins.code]
+            if acc_redundant(ins, state):
+                dead.add(i)
+                continue
+            if f & Instrument.READS_ACC:
+                load = None
+            elif f & Instrument.WRITES_ACC:
+                # the previous load is overwritten before anything reads it
+                if load is not None:
+                    dead.add(load)
+                load = i if ins.code == Instrument.CPF else None
+            state = acc_transfer(ins, state)
+    if len(dead) == 0:
+        return False, hrm
+    return True, [ins for i, ins in enumerate(hrm) if i not in dead]
+
+
+def reachable(blocks: List[Block]) -> int:
+    seen = 1
+    stack = [0]
+    while stack:
+        for s in blocks[stack.pop()].succs:
+            if not seen >> s & 1:
+                seen |= 1 << s
+                stack.append(s)
+    return seen
+
+
+def reverse_postorder(blocks: List[Block]) -> List[int]:
+    # the blocks reachable from the entry, the entry first and each other block after its
+    # predecessors except along back edges
+    order = []
+    seen = 1
+    stack = [(0, iter(blocks[0].succs))]
+    while stack:
+        n, succs = stack[-1]
+        for s in succs:
+            if not seen >> s & 1:
+                seen |= 1 << s
+                stack.append((s, iter(blocks[s].succs)))
+                break
+        else:
+            stack.pop()
+            order.append(n)
+    order.reverse()
+    return order
+
+
+def dominators(blocks: List[Block], reach: int) -> List[int]:
+    # bit m of dom[n] is set when every path from the entry to block n passes block m.
+    # Visited in reverse postorder, a reducible flow graph settles in one sweep and a
+    # second finds nothing changed; only irreducible loops take more.
+    every = (1 << len(blocks)) - 1
+    dom = [every] * len(blocks)
+    dom[0] = 1
+    order = reverse_postorder(blocks)[1:]
+    changed = True
+    while changed:
+        changed = False
+        for n in order:
+            d = every
+            for p in blocks[n].preds:
+                if reach >> p & 1:
+                    d &= dom[p]
+            d |= 1 << n
+            if d != dom[n]:
+                dom[n] = d
+                changed = True
+    return dom
+
+
+def natural_loops(blocks: List[Block], dom: List[int], reach: int) -> Dict[int, int]:
+    # header -> blocks of the loop, merged over every back edge into the header
+    loops: Dict[int, int] = {}
+    for n, b in enumerate(blocks):
+        if not reach >> n & 1:
+            continue
+        for h in b.succs:
+            if not dom[n] >> h & 1:
+                continue
+            body = loops.get(h, 1 << h)
+            stack = [n]
+            while stack:
+                m = stack.pop()
+                if not body >> m & 1:
+                    body |= 1 << m
+                    stack.extend(p for p in blocks[m].preds if reach >> p & 1)
+            loops[h] = body
+    return loops
+
+
+def defined_tiles(hrm: List[Instrument], blocks: List[Block], preset: int, reach: int) -> List[int]:
+    # tiles written on every path from the entry to the start of each block
+    writes = []
+    for b in blocks:
+        w = 0
+        for i in range(b.start, b.end):
+            if flags[hrm[i].code] & Instrument.WRITES_TILE and hrm[i].arg < indirect:
+                w |= 1 << hrm[i].arg
+        writes.append(w)
+    defined = [all_tiles] * len(blocks)
+    defined[0] = preset
+    # in reverse postorder, like dominators; blocks never reached keep every tile
+    order = reverse_postorder(blocks)[1:]
+    changed = True
+    while changed:
+        changed = False
+        for n in order:
+            d = all_tiles
+            for p in blocks[n].preds:
+                if reach >> p & 1:
+                    d &= defined[p] | writes[p]
+            if d != defined[n]:
+                defined[n] = d
+                changed = True
+    return defined
+
+
+def acc_dead(hrm: List[Instrument], start: int, end: int) -> bool:
+    # the hands are overwritten before anything in hrm[start:end] reads them
+    for i in range(start, end):
+        f = flags[hrm[i].code]
+        if f & Instrument.READS_ACC:
+            return False
+        if f & Instrument.WRITES_ACC:
+            return True
+    return False
+
+
+def o_loop_invariant(hrm: List[Instrument]) -> Tuple[bool, List[Instrument]]:
+    used = 0
+    for ins in hrm:
+        if flags[ins.code] & (Instrument.READS_TILE | Instrument.WRITES_TILE):
+            if ins.arg >= indirect:
+                # a fresh tile could hold data read through a pointer
+                return False, hrm
+            used |= 1 << ins.arg
+    blocks = build_cfg(hrm)
+    if len(blocks) == 0:
+        return False, hrm
+    reach = reachable(blocks)
+    loops = natural_loops(blocks, dominators(blocks, reach), reach)
+    if len(loops) == 0:
+        return False, hrm
+    live_in, live_out = liveness(hrm, blocks, alias=False)
+    defined = defined_tiles(hrm, blocks, live_in[0], reach)
+    used |= live_in[0]
+    lab = max([ins.arg for ins in hrm if ins.code == Instrument.LAB], default=-1) + 1
+    # code replacing each position edited, and the blocks edited; the analysis of a loop
+    # around an edited block is stale, so that loop waits for the next call
+    edits: Dict[int, List[Instrument]] = {}
+    moved = 0
+    # innermost loops first, so code can move out one level at a time
+    for h, body in sorted(loops.items(), key=lambda hb: bin(hb[1]).count("1")):
+        if body & moved:
+            continue
+        while True:
+            found = hoist_invariant(hrm, blocks, h, body, live_out, defined[h], used, moved)
+            if found is None:
+                break
+            done = move_run(hrm, blocks, h, body, *found, used, lab, edits)
+            if done is None:
+                break
+            taken, changed, lab = done
+            used |= taken
+            moved |= changed
+    if len(edits) == 0:
+        return False, hrm
+    opt = []
+    for j, ins in enumerate(hrm):
+        opt.extend(edits.get(j, [ins]))
+    return True, opt
+
+
+def hoist_invariant(hrm: List[Instrument],
+                    blocks: List[Block],
+                    h: int,
+                    body: int,
+                    live_out: List[int],
+                    defined: int,
+                    used: int,
+                    moved: int) -> Optional[Tuple[int, int, int, List[int], int]]:
+    # the first invariant COPYFROM ... COPYTO run of the loop outside the blocks already
+    # moved, as (start, last, tiles written, uses to rename, end of its block)
+    header = blocks[h]
+    # no preheader if the loop falls into its header, or the hands carry a value into the loop
+    preheader = not (h > 0 and body >> (h - 1) & 1 and hrm[blocks[h - 1].end - 1].code != Instrument.JMP) \
+        and acc_dead(hrm, header.start, header.end)
+    members = [n for n in range(len(blocks)) if body >> n & 1]
+    loop_writes = 0
+    for n in members:
+        for i in range(blocks[n].start, blocks[n].end):
+            if flags[hrm[i].code] & Instrument.WRITES_TILE:
+                loop_writes |= 1 << hrm[i].arg
+    straight = (Instrument.CPF, Instrument.CPT, Instrument.ADD, Instrument.SUB, Instrument.INC, Instrument.DEC)
+    for n in members:
+        if moved >> n & 1:
+            continue
+        b = blocks[n]
+        # arithmetic may overflow, so it only moves when it runs each time the loop is entered
+        safe_arith = preheader and n == h
+        for i in range(b.start, b.end):
+            if hrm[i].code in (Instrument.IN, Instrument.OUT):
+                safe_arith = False
+            if hrm[i].code != Instrument.CPF:
+                continue
+            best = None
+            reads = 0
+            writes = 0
+            arith = False
+            for k in range(i, b.end):
+                ins = hrm[k]
+                if ins.code not in straight:
+                    break
+                f = flags[ins.code]
+                if f & Instrument.READS_TILE and not writes >> ins.arg & 1:
+                    reads |= 1 << ins.arg
+                if f & Instrument.WRITES_TILE:
+                    writes |= 1 << ins.arg
+                arith = arith or ins.code not in (Instrument.CPF, Instrument.CPT)
+                if reads & loop_writes or reads & ~defined or arith and not safe_arith:
+                    break
+                if f & Instrument.WRITES_TILE:
+                    renames = local_uses(hrm, k + 1, b.end, writes, live_out[n])
+                    if renames is not None:
+                        best = k, writes, renames
+            if best is not None:
+                return (i,) + best + (b.end,)
+    return None
+
+
+def local_uses(hrm: List[Instrument], start: int, end: int, tiles: int, live: int) -> Optional[List[int]]:
+    # positions reading the values the run left in tiles, all before the end of its block
+    renames = []
+    pending = tiles
+    for j in range(start, end):
+        ins = hrm[j]
+        f = flags[ins.code]
+        if not f & (Instrument.READS_TILE | Instrument.WRITES_TILE) or not pending >> ins.arg & 1:
+            continue
+        if ins.code in (Instrument.INC, Instrument.DEC):
+            return None
+        if ins.code == Instrument.CPT:
+            pending &= ~(1 << ins.arg)
+        else:
+            renames.append(j)
+    return None if pending & live else renames
+
+
+def move_run(hrm: List[Instrument],
+             blocks: List[Block],
+             h: int,
+             body: int,
+             i: int,
+             k: int,
+             writes: int,
+             renames: List[int],
+             end: int,
+             used: int,
+             lab: int,
+             edits: Dict[int, List[Instrument]]) -> Optional[Tuple[int, int, int]]:
+    # records in edits the code for moving hrm[i:k + 1] in front of the loop; returns the
+    # fresh tiles taken, the blocks edited and the next free label, or None if out of tiles
+    fresh = {}
+    copies = all(ins.code in (Instrument.CPF, Instrument.CPT) for ins in hrm[i:k + 1])
+    if copies:
+        # only copies of tiles the loop never writes: the uses read the source instead,
+        # and nothing has to run before the loop
+        src = None
+        for ins in hrm[i:k + 1]:
+            if ins.code == Instrument.CPF:
+                src = fresh.get(ins.arg, ins.arg)
+            else:
+                fresh[ins.arg] = src
+    else:
+        free = all_tiles & ~used
+        for t in range(indirect):
+            if writes >> t & 1:
+                if free == 0:
+                    return None
+                fresh[t] = free.bit_length() - 1
+                free &= ~(1 << fresh[t])
+
+    def rename(ins: Instrument) -> Instrument:
+        return Instrument(ins.code, fresh[ins.arg]) if ins.arg in fresh else ins
+
+    n = next(m for m, b in enumerate(blocks) if b.start <= i < b.end)
+    changed = 1 << n | 1 << h
+    # the hands equal the last tile written, if anything still reads them
+    keep = [] if acc_dead(hrm, k + 1, end) else [Instrument(Instrument.CPF, fresh[hrm[k].arg])]
+    for j in range(i, k):
+        edits[j] = []
+    edits[k] = keep
+    for j in renames:
+        edits[j] = [rename(hrm[j])]
+
+    start = blocks[h].start
+    pre = [] if copies else [rename(ins) for ins in hrm[i:k + 1]]
+    if len(pre) > 0 and hrm[start].code == Instrument.LAB:
+        outside = [p for p in blocks[h].preds if not body >> p & 1
+                   and flags[hrm[blocks[p].end - 1].code] & Instrument.IS_JUMP
+                   and hrm[blocks[p].end - 1].arg == hrm[start].arg]
+        if len(outside) > 0:
+            pre = [Instrument(Instrument.LAB, lab)] + pre
+            for p in outside:
+                edits[blocks[p].end - 1] = [Instrument(hrm[blocks[p].end - 1].code, lab)]
+                changed |= 1 << p
+            lab += 1
+    if len(pre) > 0:
+        edits[start] = pre + edits.get(start, [hrm[start]])
+    taken = sum(1 << t for t in fresh.values()) if not copies else 0
+    return taken, changed, lab
+
+
+def block_frequencies(hrm: List[Instrument],
+                      blocks: List[Block],
+                      odds: List[Dict[int, float]],
+                      halt: float = 0.125,
+                      rounds: int = 1000) -> Tuple[List[float], List[float], List[float]]:
+    # expected entries into each block in a run where each INBOX finds the inbox empty with
+    # probability halt and block n goes on to block s with probability odds[n][s];
+    # also the share of the entries that leave each block and the steps per entry
+    survive = []  # share of the entries into a block that leave it
+    weight = []  # steps per entry into a block
+    for b in blocks:
+        s = 1.0
+        w = 0.0
+        for i in range(b.start, b.end):
+            if hrm[i].code == Instrument.IN:
+                s *= 1 - halt
+            if hrm[i].code != Instrument.LAB:
+                w += s
+        survive.append(s)
+        weight.append(w)
+    preds = [sorted(set(b.preds)) for b in blocks]
+    freq = [0.0] * len(blocks)
+    total = 0.0
+    for _ in range(rounds):
+        for n in range(len(blocks)):
+            f = 1.0 if n == 0 else 0.0
+            for p in preds[n]:
+                f += freq[p] * survive[p] * odds[p][n]
+            freq[n] = f
+        last, total = total, sum(f * w for f, w in zip(freq, weight))
+        if total - last <= total * 1e-9:
+            break
+    return freq, survive, weight
+
+
+def even_odds(blocks: List[Block]) -> List[Dict[int, float]]:
+    odds = []
+    for b in blocks:
+        o: Dict[int, float] = {}
+        for s in b.succs:
+            o[s] = o.get(s, 0.0) + 1 / len(b.succs)
+        odds.append(o)
+    return odds
+
+
+def loop_odds(blocks: List[Block], stay: float = 0.88) -> List[Dict[int, float]]:
+    # a branch where one side leaves the innermost loop around it mostly stays in the loop
+    reach = reachable(blocks)
+    loops = sorted(natural_loops(blocks, dominators(blocks, reach), reach).values(),
+                   key=lambda body: bin(body).count("1"))
+    odds = even_odds(blocks)
+    for n, b in enumerate(blocks):
+        if len(odds[n]) != 2:
+            continue
+        inner = next((body for body in loops if body >> n & 1), 0)
+        inside = [s for s in odds[n] if inner >> s & 1]
+        if len(inside) == 1:
+            odds[n] = {s: stay if s in inside else 1 - stay for s in odds[n]}
+    return odds
+
+
+def estimate_steps(hrm: List[Instrument], halt: float = 0.125, rounds: int = 1000) -> float:
+    # expected steps of a run where each INBOX finds the inbox empty with probability halt
+    # and a conditional jump goes either way with even odds
+    blocks = build_cfg(hrm)
+    if len(blocks) == 0:
+        return 0.0
+    freq, _, weight = block_frequencies(hrm, blocks, even_odds(blocks), halt, rounds)
+    return sum(f * w for f, w in zip(freq, weight))
+
+
+class CostModel:
+    # weighs instruction count against steps; steps are measured on a sample inbox
+    # when one is given and the program runs it, otherwise estimated from the control flow
+    def __init__(self,
+                 optimize_for: Objective = "size",
+                 inbox: Optional[Sequence[int]] = None,
+                 floor: Optional[Dict[int, int]] = None,
+                 growth: float = 2.0) -> None:
+        if optimize_for == "size":
+            self.weight = 1.0
+        elif optimize_for == "speed":
+            self.weight = 0.0
+        elif isinstance(optimize_for, (int, float)) and 0 <= optimize_for <= 1:
+            self.weight = float(optimize_for)
+        else:
+            raise ValueError(f"optimize_for must be 'size', 'speed' or a weight in [0, 1], not {optimize_for!r}")
+        self.inbox = inbox
+        self.floor = floor
+        # code may grow to this many times its size before steps are traded for it
+        self.growth = growth
+
+    def steps(self, hrm: List[Instrument]) -> Tuple[float, bool]:
+        # (steps, measured)
+        if self.inbox is not None:
+            try:
+                return simulate(hrm, self.inbox, self.floor)[1], True
+            except RuntimeError:
+                pass
+        return estimate_steps(hrm), False
+
+    def cost(self, hrm: List[Instrument]) -> Tuple[float, int, float]:
+        # steps weighed by 0 are not worked out, so equal sizes tie
+        size = instruction_count(hrm)
+        steps = self.steps(hrm)[0] if self.weight < 1 else 0.0
+        return self.weight * size + (1 - self.weight) * steps, size, steps
+
+
+def tail_duplicates(hrm: List[Instrument], limit: int = 16) -> Iterator[List[Instrument]]:
+    # JUMP a replaced by the code from a to the next JUMP, leaving out its labels; jumps in the
+    # copy still go to the original code. A JUMP back to its loop head unrolls the loop once.
+    where = {ins.arg: i for i, ins in enumerate(hrm) if ins.code == Instrument.LAB}
+    for i, ins in enumerate(hrm):
+        if ins.code != Instrument.JMP:
+            continue
+        tail = []
+        for j in range(where[ins.arg] + 1, len(hrm)):
+            if hrm[j].code != Instrument.LAB:
+                tail.append(hrm[j])
+            if hrm[j].code == Instrument.JMP or len(tail) > limit:
+                break
+        if 1 < len(tail) <= limit and tail[-1].code == Instrument.JMP:
+            yield hrm[:i] + tail + hrm[i + 1:]
+
+
+def duplicate_tails(hrm: List[Instrument],
+                    model: CostModel,
+                    manager: "PassManager") -> Tuple[bool, List[Instrument]]:
+    # greedily take the duplication that lowers the cost most once cleaned up, until none does
+    cost = model.cost(hrm)
+    size_limit = model.growth * max(cost[1], 1)
+    changed = False
+    while True:
+        best = None
+        for opt in tail_duplicates(hrm):
+            opt = manager.run(opt)
+            c = model.cost(opt)
+            if c < cost and c[1] <= size_limit and (best is None or c < best[0]):
+                best = c, opt
+        if best is None:
+            return changed, hrm
+        cost, hrm = best
+        changed = True
+
+
+def static_edges(hrm: List[Instrument], blocks: List[Block]) -> Dict[Tuple[int, int], float]:
+    odds = loop_odds(blocks)
+    freq, survive, _ = block_frequencies(hrm, blocks, odds)
+    return {(n, s): freq[n] * survive[n] * p for n in range(len(blocks)) for s, p in odds[n].items()}
+
+
+def profile_edges(hrm: List[Instrument],
+                  blocks: List[Block],
+                  inbox: Sequence[int],
+                  floor: Optional[Dict[int, int]] = None) -> Optional[Dict[Tuple[int, int], float]]:
+    # times each edge is taken on a sample inbox, or None if the program fails on it.
+    # Every conditional jump is sent through a stub "s: JUMP target" after the program,
+    # so the hits of the stub are the times it was taken.
+    lab = max([ins.arg for ins in hrm if ins.code == Instrument.LAB], default=-1) + 1
+    probe = list(hrm)
+    stubs = []
+    stub = {}
+    for b in blocks:
+        i = b.end - 1
+        if hrm[i].code in (Instrument.JZ, Instrument.JN):
+            probe[i] = Instrument(hrm[i].code, lab)
+            stubs += [Instrument(Instrument.LAB, lab), Instrument(Instrument.JMP, hrm[i].arg)]
+            stub[i] = len(hrm) + len(stubs)
+            lab += 1
+    probe += [Instrument(Instrument.JMP, lab)] + stubs + [Instrument(Instrument.LAB, lab)]
+    try:
+        _, _, hits = simulate(probe, inbox, floor)
+    except RuntimeError:
+        return None
+    edges: Dict[Tuple[int, int], float] = {}
+    for n, b in enumerate(blocks):
+        i = b.end - 1
+        follow = [n + 1] if n + 1 < len(blocks) else []
+        if i in stub:
+            flow = [(b.succs[0], hits[stub[i]])] + [(s, hits[i] - hits[stub[i]]) for s in follow]
+        elif hrm[i].code == Instrument.JMP:
+            flow = [(b.succs[0], hits[i])]
+        else:
+            flow = [(s, hits[i]) for s in follow]
+        for s, w in flow:
+            edges[n, s] = edges.get((n, s), 0) + w
+    return edges
+
+
+def layout(hrm: List[Instrument], blocks: List[Block], edges: Dict[Tuple[int, int], float]) -> List[Instrument]:
+    # chain blocks along their heaviest edges so that those fall through: a JUMP is dropped
+    # when its target comes next, and a block that would fall into a block placed elsewhere
+    # gets a JUMP to it. HRM has no inverted JUMPZ/JUMPN to flip a branch with, so only
+    # blocks that end in a JUMP or in plain code choose what follows them.
+    def follower(n: int) -> Optional[int]:
+        if hrm[blocks[n].end - 1].code == Instrument.JMP:
+            return blocks[n].succs[0]
+        return n + 1 if n + 1 < len(blocks) else None
+
+    head = list(range(len(blocks)))  # first block of the chain of each block
+    chains = {n: [n] for n in range(len(blocks))}
+    for (u, v), w in sorted(edges.items(), key=lambda e: (-e[1], e[0])):
+        if w <= 0 or v == 0 or follower(u) != v or head[v] != v or head[u] == v or chains[head[u]][-1] != u:
+            continue
+        for m in chains[v]:
+            head[m] = head[u]
+        chains[head[u]].extend(chains.pop(v))
+    # the entry chain first and the one that runs off the end of the program last
+    tail = head[-1] if follower(len(blocks) - 1) is None else None
+    order = [n for h in sorted(chains, key=lambda h: (h != 0, h == tail, h)) for n in chains[h]]
+    after = {n: order[k + 1] if k + 1 < len(order) else None for k, n in enumerate(order)}
+
+    labels = {n: hrm[b.start].arg for n, b in enumerate(blocks) if hrm[b.start].code == Instrument.LAB}
+    lab = max([ins.arg for ins in hrm if ins.code == Instrument.LAB], default=-1) + 1
+    jumps = {}
+    for n in order:
+        f = follower(n)
+        if hrm[blocks[n].end - 1].code != Instrument.JMP and after[n] != f:
+            if f not in labels:
+                labels[f], lab = lab, lab + 1
+            jumps[n] = labels[f]
+    opt = []
+    for n in order:
+        b = blocks[n]
+        if n in labels and hrm[b.start].code != Instrument.LAB:
+            opt.append(Instrument(Instrument.LAB, labels[n]))
+        if hrm[b.end - 1].code == Instrument.JMP and after[n] == follower(n):
+            opt.extend(hrm[b.start:b.end - 1])
+        else:
+            opt.extend(hrm[b.start:b.end])
+        if n in jumps:
+            opt.append(Instrument(Instrument.JMP, jumps[n]))
+    if None in labels:
+        opt.append(Instrument(Instrument.LAB, labels[None]))
+    return opt
+
+
+def reorder_blocks(hrm: List[Instrument],
+                   model: "CostModel",
+                   manager: "PassManager") -> Tuple[bool, List[Instrument]]:
+    # lay blocks out by a profile on the model's sample inbox, or by static odds without one;
+    # kept only if the cost model prefers the result. Where steps do not count, any chain
+    # saves the same JUMPs, so edges are weighed by their odds alone.
+    blocks = build_cfg(hrm)
+    if len(blocks) < 2:
+        return False, hrm
+    edges = None
+    if model.weight == 1:
+        edges = {(n, s): p for n, odds in enumerate(loop_odds(blocks)) for s, p in odds.items()}
+    elif model.inbox is not None:
+        edges = profile_edges(hrm, blocks, model.inbox, model.floor)
+    if edges is None:
+        edges = static_edges(hrm, blocks)
+    opt = manager.run(layout(hrm, blocks, edges))
+    if model.cost(opt) < model.cost(hrm):
+        return True, opt
+    return False, hrm
 
 
 def remap_labels(hrm: List[Instrument]) -> Tuple[bool, List[Instrument]]:
@@ -98,11 +950,86 @@ def remap_labels(hrm: List[Instrument]) -> Tuple[bool, List[Instrument]]:
     if lab == list(range(len(lab))):
         return False, hrm
     else:
+        idx = {l: i for i, l in enumerate(lab)}
         opt = []
         for i in hrm:
-            if i.code == Instrument.LAB or i.code.startswith("JUMP"):
-                idx = lab.index(i.arg)
-                opt.append(Instrument(i.code, idx))
+            if i.code == Instrument.LAB or flags[i.code] & Instrument.IS_JUMP:
+                opt.append(Instrument(i.code, idx[i.arg]))
             else:
                 opt.append(i)
         return True, opt
+
+
+default_passes: List[Pass] = [
+    o_peephole,
+    o_continuous_label,
+    o_immediate_jump,
+    o_unref_label,
+    o_dead_code,
+    o_dead_store,
+    o_acc_value,
+    o_loop_invariant,
+]
+
+# passes that may find new work once the key pass has changed the program
+default_triggers: Dict[Pass, List[Pass]] = {
+    o_peephole: [o_unref_label, o_dead_code, o_dead_store, o_acc_value, o_loop_invariant],
+    o_continuous_label: [o_peephole, o_unref_label],
+    o_immediate_jump: [o_peephole, o_unref_label],
+    o_unref_label: [o_peephole, o_continuous_label, o_immediate_jump, o_dead_code, o_acc_value],
+    o_dead_code: [o_peephole, o_continuous_label, o_immediate_jump, o_unref_label, o_dead_store,
+                  o_acc_value, o_loop_invariant],
+    o_dead_store: [o_peephole, o_acc_value, o_loop_invariant],
+    o_acc_value: [o_peephole, o_dead_store, o_loop_invariant],
+    o_loop_invariant: [o_peephole, o_unref_label, o_dead_store, o_acc_value, o_loop_invariant],
+}
+
+
+class PassManager:
+    def __init__(self,
+                 passes: Optional[List[Pass]] = None,
+                 triggers: Optional[Dict[Pass, List[Pass]]] = None,
+                 profiler: Optional["Profiler"] = None) -> None:
+        self.passes = passes if passes is not None else default_passes
+        self.triggers = triggers if triggers is not None else default_triggers
+        self.profiler = profiler
+        self.runs: Dict[str, int] = {}
+        self.changes: Dict[str, int] = {}
+        self.rules: Dict[str, int] = {}
+        self.changed = False
+        # arguments a pass gets from the manager, so its counters are per compile
+        self.pass_args: Dict[Pass, Tuple] = {o_peephole: (self.rules,)}
+
+    def run(self, hrm: List[Instrument]) -> List[Instrument]:
+        work = deque(self.passes)
+        queued = set(self.passes)
+        while work:
+            f = work.popleft()
+            queued.discard(f)
+            r, hrm = self.apply(f, hrm, *self.pass_args.get(f, ()))
+            if r:
+                for g in self.triggers.get(f, self.passes):
+                    if g not in queued:
+                        work.append(g)
+                        queued.add(g)
+        _, hrm = self.apply(remap_labels, hrm)
+        return hrm
+
+    def apply(self,
+              f: Callable[..., Tuple[bool, List[Instrument]]],
+              hrm: List[Instrument],
+              *args) -> Tuple[bool, List[Instrument]]:
+        # one run of f, timed when a profiler is attached
+        if self.profiler is None:
+            r, hrm = f(hrm, *args)
+        else:
+            r, hrm = self.profiler.run_pass(f, hrm, *args)
+        self.record(f, r)
+        return r, hrm
+
+    def record(self, f: Pass, changed: bool) -> None:
+        name = f.__name__
+        self.runs[name] = self.runs.get(name, 0) + 1
+        if changed:
+            self.changes[name] = self.changes.get(name, 0) + 1
+            self.changed = True
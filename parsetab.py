@@ -0,0 +1,54 @@
+
+# parsetab.py
+# This file is automatically generated. Do not edit.
+# pylint: disable=W,C,R
+_tabversion = '3.10'
+
+_lr_method = 'LALR'
+
+_lr_signature = "ASSIGN CONST DO ELSE IF NAME THENPROG : FUNC PROG\n            | FUNCFUNC : NAME PARMS '=' EXPR\n            | NAME PARMS GUARDSPARMS : NAME PARMS\n             | emptyGUARDS : GUARD GUARDS\n              | GUARDGUARD : '|' EXPR '=' EXPREXPR : DO '{' STMTS '}'\n            | IF EXPR THEN EXPR ELSE EXPR\n            | CALLSTMTS : STMT ';' STMTS\n             | EXPRSTMT : ASSG\n            | EXPRASSG : NAME ASSIGN EXPRCALL : NAME ARGSARGS : ARG ARGS\n            | emptyARG : '(' CALL ')'ARG : NAMEARG : CONSTempty :"
+    
+_lr_action_items = {'NAME':([0,2,3,5,9,10,11,12,13,14,16,17,18,20,21,22,23,24,25,26,28,29,35,36,37,38,39,40,41,45,46,],[3,3,5,5,13,-4,-8,13,20,-3,13,-12,-7,-22,-18,20,-20,13,-23,35,13,-19,20,13,-9,-21,-10,35,13,13,-11,]),'$end':([1,2,4,10,11,13,14,17,18,20,21,22,23,25,29,37,38,39,46,],[0,-2,-1,-4,-8,-24,-3,-12,-7,-22,-18,-24,-20,-23,-19,-9,-21,-10,-11,]),'=':([3,5,6,7,8,13,17,19,20,21,22,23,25,29,38,39,46,],[-24,-24,9,-6,-5,-24,-12,28,-22,-18,-24,-20,-23,-19,-21,-10,-11,]),'|':([3,5,6,7,8,11,13,17,20,21,22,23,25,29,37,38,39,46,],[-24,-24,12,-6,-5,12,-24,-12,-22,-18,-24,-20,-23,-19,-9,-21,-10,-11,]),'DO':([9,12,16,26,28,36,40,41,45,],[15,15,15,15,15,15,15,15,15,]),'IF':([9,12,16,26,28,36,40,41,45,],[16,16,16,16,16,16,16,16,16,]),'(':([13,20,22,25,35,38,],[24,-22,24,-23,24,-21,]),'CONST':([13,20,22,25,35,38,],[25,-22,25,-23,25,-21,]),'THEN':([13,17,20,21,22,23,25,27,29,38,39,46,],[-24,-12,-22,-18,-24,-20,-23,36,-19,-21,-10,-11,]),')':([13,20,21,22,23,25,29,30,38,],[-24,-22,-18,-24,-20,-23,-19,38,-21,]),'ELSE':([13,17,20,21,22,23,25,29,38,39,42,46,],[-24,-12,-22,-18,-24,-20,-23,-19,-21,-10,45,-11,]),';':([13,17,20,21,22,23,25,29,32,33,34,35,38,39,44,46,],[-24,-12,-22,-18,-24,-20,-23,-19,40,-16,-15,-24,-21,-10,-17,-11,]),'}':([13,17,20,21,22,23,25,29,31,33,35,38,39,43,46,],[-24,-12,-22,-18,-24,-20,-23,-19,39,-14,-24,-21,-10,-13,-11,]),'{':([15,],[26,]),'ASSIGN':([35,],[41,]),}
+
+_lr_action = {}
+for _k, _v in _lr_action_items.items():
+   for _x,_y in zip(_v[0],_v[1]):
+      if not _x in _lr_action:  _lr_action[_x] = {}
+      _lr_action[_x][_k] = _y
+del _lr_action_items
+
+_lr_goto_items = {'PROG':([0,2,],[1,4,]),'FUNC':([0,2,],[2,2,]),'PARMS':([3,5,],[6,8,]),'empty':([3,5,13,22,35,],[7,7,23,23,23,]),'GUARDS':([6,11,],[10,18,]),'GUARD':([6,11,],[11,11,]),'EXPR':([9,12,16,26,28,36,40,41,45,],[14,19,27,33,37,42,33,44,46,]),'CALL':([9,12,16,24,26,28,36,40,41,45,],[17,17,17,30,17,17,17,17,17,17,]),'ARGS':([13,22,35,],[21,29,21,]),'ARG':([13,22,35,],[22,22,22,]),'STMTS':([26,40,],[31,43,]),'STMT':([26,40,],[32,32,]),'ASSG':([26,40,],[34,34,]),}
+
+_lr_goto = {}
+for _k, _v in _lr_goto_items.items():
+   for _x, _y in zip(_v[0], _v[1]):
+       if not _x in _lr_goto: _lr_goto[_x] = {}
+       _lr_goto[_x][_k] = _y
+del _lr_goto_items
+_lr_productions = [
+  ("S' -> PROG","S'",1,None,None,None),
+  ('PROG -> FUNC PROG','PROG',2,'p_PROG','yacc.py',11),
+  ('PROG -> FUNC','PROG',1,'p_PROG','yacc.py',12),
+  ('FUNC -> NAME PARMS = EXPR','FUNC',4,'p_FUNC','yacc.py',17),
+  ('FUNC -> NAME PARMS GUARDS','FUNC',3,'p_FUNC','yacc.py',18),
+  ('PARMS -> NAME PARMS','PARMS',2,'p_PARMS','yacc.py',26),
+  ('PARMS -> empty','PARMS',1,'p_PARMS','yacc.py',27),
+  ('GUARDS -> GUARD GUARDS','GUARDS',2,'p_GUARDS','yacc.py',32),
+  ('GUARDS -> GUARD','GUARDS',1,'p_GUARDS','yacc.py',33),
+  ('GUARD -> | EXPR = EXPR','GUARD',4,'p_GUARD','yacc.py',38),
+  ('EXPR -> DO { STMTS }','EXPR',4,'p_EXPR','yacc.py',43),
+  ('EXPR -> IF EXPR THEN EXPR ELSE EXPR','EXPR',6,'p_EXPR','yacc.py',44),
+  ('EXPR -> CALL','EXPR',1,'p_EXPR','yacc.py',45),
+  ('STMTS -> STMT ; STMTS','STMTS',3,'p_STMTS','yacc.py',55),
+  ('STMTS -> EXPR','STMTS',1,'p_STMTS','yacc.py',56),
+  ('STMT -> ASSG','STMT',1,'p_STMT','yacc.py',61),
+  ('STMT -> EXPR','STMT',1,'p_STMT','yacc.py',62),
+  ('ASSG -> NAME ASSIGN EXPR','ASSG',3,'p_ASSG','yacc.py',67),
+  ('CALL -> NAME ARGS','CALL',2,'p_CALL','yacc.py',72),
+  ('ARGS -> ARG ARGS','ARGS',2,'p_ARGS','yacc.py',77),
+  ('ARGS -> empty','ARGS',1,'p_ARGS','yacc.py',78),
+  ('ARG -> ( CALL )','ARG',3,'p_ARG_CALL','yacc.py',83),
+  ('ARG -> NAME','ARG',1,'p_ARG_NAME','yacc.py',88),
+  ('ARG -> CONST','ARG',1,'p_ARG_CONST','yacc.py',96),
+  ('empty -> <empty>','empty',0,'p_empty','yacc.py',104),
+]
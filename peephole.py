@@ -0,0 +1,151 @@
+from typing import Callable, Dict, List, Optional, Tuple
+
+from compiler import Instrument, indirect
+
+# pattern element: (opcode, operand variable or None)
+Element = Tuple[int, Optional[str]]
+Guard = Callable[[Dict[str, int]], bool]
+
+codes = {name: code for code, name in enumerate(Instrument.names)}
+
+
+def parse_pattern(text: str) -> List[Element]:
+    # "COPYTO x; COPYFROM x", labels are written "a:"
+    elements = []
+    for part in text.split(";"):
+        words = part.split()
+        if len(words) == 0:
+            continue
+        if len(words) == 1 and words[0].endswith(":"):
+            elements.append((Instrument.LAB, words[0][:-1]))
+        elif words[0] in codes and len(words) <= 2:
+            elements.append((codes[words[0]], words[1] if len(words) == 2 else None))
+        else:
+            raise ValueError(f"bad pattern element {part.strip()!r}")
+    return elements
+
+
+class Rule:
+    __slots__ = ("name", "pattern", "replace", "where")
+
+    def __init__(self, name: str, pattern: str, replace: str, where: Optional[Guard] = None) -> None:
+        self.name = name
+        self.pattern = parse_pattern(pattern)
+        self.replace = parse_pattern(replace)
+        self.where = where
+        # every rewrite shrinks the program, so rewriting always stops
+        if len(self.replace) >= len(self.pattern):
+            raise ValueError(f"rule {name!r} does not shrink the code")
+        if not {v for _, v in self.replace} <= {v for _, v in self.pattern}:
+            raise ValueError(f"rule {name!r} uses an unbound operand")
+
+    def bind(self, window: List[Instrument]) -> Optional[Dict[str, int]]:
+        binds: Dict[str, int] = {}
+        for (_, var), ins in zip(self.pattern, window):
+            if var is None:
+                continue
+            if binds.setdefault(var, ins.arg) != ins.arg:
+                return None
+        if self.where is not None and not self.where(binds):
+            return None
+        return binds
+
+
+class Node:
+    __slots__ = ("next", "rules")
+
+    def __init__(self) -> None:
+        self.next: Dict[int, "Node"] = {}
+        self.rules: List[Rule] = []
+
+
+class Peephole:
+    # all rules are merged into one trie over their opcodes, last instruction first;
+    # the program is streamed into an output list and after each instruction the trie is
+    # walked back from the end of the output, so matching costs the longest pattern, not
+    # the number of rules. A replacement is pushed back onto the input, and only the
+    # instructions it produced are matched again.
+    def __init__(self, rules: List[Rule]) -> None:
+        self.rules = rules
+        self.root = Node()
+        for rule in rules:
+            node = self.root
+            for code, _ in reversed(rule.pattern):
+                node = node.next.setdefault(code, Node())
+            node.rules.append(rule)
+
+    def match(self, out: List[Instrument]) -> Optional[Tuple[Rule, int, Dict[str, int]]]:
+        # the longest pattern ending at the last instruction; among equal lengths, the first rule
+        best = None
+        node = self.root
+        for k in range(1, len(out) + 1):
+            node = node.next.get(out[-k].code)
+            if node is None:
+                break
+            for rule in node.rules:
+                binds = rule.bind(out[-k:])
+                if binds is not None:
+                    best = rule, k, binds
+                    break
+        return best
+
+    def __call__(self, hrm: List[Instrument], hits: Optional[Dict[str, int]] = None) -> Tuple[bool, List[Instrument]]:
+        # rule hits are counted into hits, so shared rules keep no state between programs
+        out: List[Instrument] = []
+        todo = hrm[::-1]
+        changed = False
+        while todo:
+            out.append(todo.pop())
+            m = self.match(out)
+            if m is None:
+                continue
+            rule, k, binds = m
+            del out[-k:]
+            todo.extend(Instrument(code, None if var is None else binds[var])
+                        for code, var in reversed(rule.replace))
+            if hits is not None:
+                hits[rule.name] = hits.get(rule.name, 0) + 1
+            changed = True
+        return changed, out
+
+
+def direct(*names: str) -> Guard:
+    return lambda m: all(m[n] < indirect for n in names)
+
+
+rules = [
+    # copies of the tile the hands already hold. A write through a pointer x that points at
+    # itself moves the pointer, so x names another tile after it and x must be direct.
+    Rule("copy to, copy from", "COPYTO x; COPYFROM x", "COPYTO x", direct("x")),
+    Rule("copy from, copy to", "COPYFROM x; COPYTO x", "COPYFROM x"),
+    Rule("copy to twice", "COPYTO x; COPYTO x", "COPYTO x", direct("x")),
+    Rule("copy from twice", "COPYFROM x; COPYFROM x", "COPYFROM x"),
+    Rule("bump up, copy from", "BUMPUP x; COPYFROM x", "BUMPUP x", direct("x")),
+    Rule("bump down, copy from", "BUMPDN x; COPYFROM x", "BUMPDN x", direct("x")),
+    Rule("bump up, copy to", "BUMPUP x; COPYTO x", "BUMPUP x", direct("x")),
+    Rule("bump down, copy to", "BUMPDN x; COPYTO x", "BUMPDN x", direct("x")),
+    # through a pointer x, y must be a direct tile other than the pointer, or it may move it
+    Rule("reload after copy from", "COPYFROM x; COPYTO y; COPYFROM x", "COPYFROM x; COPYTO y",
+         lambda m: m["x"] < indirect or m["y"] < indirect and m["y"] != m["x"] - indirect),
+    Rule("reload after copy to", "COPYTO x; COPYTO y; COPYFROM x", "COPYTO x; COPYTO y",
+         lambda m: m["x"] < indirect or m["y"] < indirect and m["y"] != m["x"] - indirect),
+    # the hands are overwritten before they are read
+    Rule("overwritten copy from", "COPYFROM x; COPYFROM y", "COPYFROM y"),
+    Rule("overwritten store", "COPYTO x; COPYFROM y; COPYTO x", "COPYFROM y; COPYTO x",
+         lambda m: direct("x", "y")(m) and m["x"] != m["y"]),
+    # arithmetic that cancels out
+    Rule("bump up, bump down", "BUMPUP x; BUMPDN x", "COPYFROM x", direct("x")),
+    Rule("bump down, bump up", "BUMPDN x; BUMPUP x", "COPYFROM x", direct("x")),
+    Rule("add, sub", "ADD x; SUB x", ""),
+    Rule("sub, add", "SUB x; ADD x", ""),
+    Rule("add the stored hands", "COPYTO x; COPYFROM y; ADD x", "COPYTO x; ADD y"),
+    # jumps
+    Rule("jump to next", "JUMP a; a:", "a:"),
+    Rule("jump zero to next", "JUMPZ a; a:", "a:"),
+    Rule("jump negative to next", "JUMPN a; a:", "a:"),
+    Rule("jump zero, jump", "JUMPZ a; JUMP a", "JUMP a"),
+    Rule("jump negative, jump", "JUMPN a; JUMP a", "JUMP a"),
+    Rule("jump zero twice", "JUMPZ a; JUMPZ b", "JUMPZ a"),
+    Rule("jump negative twice", "JUMPN a; JUMPN b", "JUMPN a"),
+    Rule("jump after jump", "JUMP a; JUMP b", "JUMP a"),
+]
@@ -0,0 +1,117 @@
+import json
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from typing import Callable, ContextManager, Dict, Iterator, List, Tuple
+
+from compiler import Instrument
+from optimizer import instruction_count
+
+# one timed span: name, category, start and duration in seconds, then its args
+Event = Dict
+
+
+class Profiler:
+    # wall time and allocation of compile phases and of each optimizer pass run; phases nest.
+    # With memory set, tracemalloc is started, which itself slows the compile down.
+    # A disabled profiler hands out a shared no-op context, so hooks cost a method call.
+    def __init__(self, enabled: bool = True, memory: bool = True) -> None:
+        self.enabled = enabled
+        self.memory = memory and enabled
+        self.events: List[Event] = []
+        self.origin = time.perf_counter()
+        # highest traced memory seen by each open phase before its children reset the peak
+        self.peaks: List[int] = []
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def phase(self, name: str, category: str = "phase", **args) -> ContextManager[Event]:
+        if not self.enabled:
+            return nothing
+        return self.span(name, category, args)
+
+    @contextmanager
+    def span(self, name: str, category: str, args: Dict) -> Iterator[Event]:
+        event = {"name": name, "category": category}
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            self.peaks.append(peak)
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            end = time.perf_counter()
+            event["start"] = start - self.origin
+            event["time"] = end - start
+            if self.memory:
+                now, peak = tracemalloc.get_traced_memory()
+                peak = max(peak, self.peaks.pop())
+                event["allocated"] = now - current
+                event["peak"] = peak - current
+                if self.peaks:
+                    self.peaks[-1] = max(self.peaks[-1], peak)
+            event.update(args)
+            self.events.append(event)
+
+    def run_pass(self,
+                 f: Callable[..., Tuple[bool, List[Instrument]]],
+                 hrm: List[Instrument],
+                 *args) -> Tuple[bool, List[Instrument]]:
+        if not self.enabled:
+            return f(hrm, *args)
+        with self.phase(f.__name__, "pass", before=instruction_count(hrm)) as info:
+            r, hrm = f(hrm, *args)
+            info["after"] = instruction_count(hrm)
+            info["changed"] = r
+        return r, hrm
+
+    def stop(self) -> None:
+        if self.memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def summary(self) -> Dict[str, Dict]:
+        # totals per phase or pass name
+        totals: Dict[str, Dict] = {}
+        for e in self.events:
+            t = totals.setdefault(e["name"], {"category": e["category"], "calls": 0, "time": 0.0})
+            t["calls"] += 1
+            t["time"] += e["time"]
+            if "allocated" in e:
+                t["allocated"] = t.get("allocated", 0) + e["allocated"]
+            if e["category"] == "pass":
+                t["changes"] = t.get("changes", 0) + e["changed"]
+                t["removed"] = t.get("removed", 0) + e["before"] - e["after"]
+        return totals
+
+    def to_json(self) -> Dict:
+        return {"events": sorted(self.events, key=lambda e: e["start"]), "summary": self.summary()}
+
+
+nothing = nullcontext({})
+disabled = Profiler(enabled=False)
+
+
+def chrome_trace(profiles: List[Tuple[str, List[Event]]]) -> Dict:
+    # Chrome trace event format (chrome://tracing, Perfetto), one thread per named profile
+    events = []
+    for tid, (name, profile) in enumerate(profiles):
+        events.append({"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}})
+        for e in profile:
+            events.append({
+                "name": e["name"],
+                "cat": e["category"],
+                "ph": "X",
+                "ts": e["start"] * 1e6,
+                "dur": e["time"] * 1e6,
+                "pid": os.getpid(),
+                "tid": tid,
+                "args": {k: v for k, v in e.items() if k not in ("name", "category", "start", "time")},
+            })
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def save_trace(path: str, profiles: List[Tuple[str, List[Event]]]) -> None:
+    with open(path, "w") as f:
+        json.dump(chrome_trace(profiles), f)
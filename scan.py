@@ -0,0 +1,68 @@
+import re
+from itertools import chain, repeat
+from typing import Callable, Iterator, List, Optional
+
+from lex import literals, reserved
+
+# leading blanks are folded into every match; the groups are tried left to right in the
+# same order as the PLY rules in lex.py, and the last one catches any other character but
+# a blank, so blanks at the very end of the input match nothing and are skipped
+pattern = re.compile(r"[ \t]*(?:([a-z][_0-9A-Za-z]*)|(-?\d+)|(\n+)|(<-)|([%s])|([^ \t]))" % re.escape(literals), re.S)
+NAME, CONST, NEWLINE, ASSIGN, LITERAL, ERROR = range(1, 7)
+
+
+class Token:
+    # lexer is only set by PLY on the token it reports a syntax error at
+    __slots__ = ("type", "value", "lineno", "lexpos", "column", "lexer")
+
+    def __init__(self, type: str, value, lineno: int, lexpos: int, column: int) -> None:
+        self.type = type
+        self.value = value
+        self.lineno = lineno
+        self.lexpos = lexpos
+        self.column = column
+
+    def __repr__(self) -> str:
+        return f"Token({self.type},{self.value!r},{self.lineno},{self.column})"
+
+
+def scan(data: str) -> List[Token]:
+    get_reserved = reserved.get
+    toks = []
+    append = toks.append
+    line = 1
+    start = 0  # offset of the first character of the current line
+    for m in pattern.finditer(data):
+        k = m.lastindex
+        pos, end = m.span(k)
+        if k == NAME:
+            value = data[pos:end]
+            append(Token(get_reserved(value, "NAME"), value, line, pos, pos - start + 1))
+        elif k == NEWLINE:
+            line += end - pos
+            start = end
+        elif k == LITERAL:
+            value = data[pos]
+            append(Token(value, value, line, pos, pos - start + 1))
+        elif k == CONST:
+            append(Token("CONST", int(data[pos:end]), line, pos, pos - start + 1))
+        elif k == ASSIGN:
+            append(Token("ASSIGN", "<-", line, pos, pos - start + 1))
+        elif k == ERROR:
+            raise ValueError(f"illegal character {data[pos]!r} at line {line}, column {pos - start + 1}")
+    return toks
+
+
+class Scanner:
+    # drop-in for the PLY lexer: yacc.parser.parse(source, lexer=Scanner());
+    # the whole input is scanned up front and token() just walks the list, then returns None
+    def __init__(self) -> None:
+        self.tokens: List[Token] = []
+        self.token: Callable[[], Optional[Token]] = repeat(None).__next__
+
+    def input(self, data: str) -> None:
+        self.tokens = scan(data)
+        self.token = chain(self.tokens, repeat(None)).__next__
+
+    def __iter__(self) -> Iterator[Token]:
+        return iter(self.tokens)
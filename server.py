@@ -0,0 +1,118 @@
+import argparse
+import hashlib
+import json
+import os
+import signal
+import socketserver
+import sys
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import yacc
+from build import compile_source, const_tiles, format_code, reserved
+from client import default_socket
+
+
+class ResultCache:
+    # LRU of formatted programs keyed by a hash of the source and floor options
+    def __init__(self, maxsize: int = 1024) -> None:
+        self.maxsize = maxsize
+        self.entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(source: str, reserved: Tuple[int, ...], const_tiles: Dict[int, int], *options) -> str:
+        h = hashlib.sha256(source.encode())
+        h.update(repr((reserved, sorted(const_tiles.items())) + options).encode())
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+
+    def put(self, key: str, result: Dict) -> None:
+        with self.lock:
+            self.entries[key] = result
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+
+class CompileHandler(socketserver.StreamRequestHandler):
+    # one JSON request per line, one JSON response per line
+    def handle(self) -> None:
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                response = self.server.compile(json.loads(line))
+            except Exception as e:
+                response = {"error": f"{type(e).__name__}: {e}"}
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+            self.wfile.flush()
+
+
+class CompileServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, cache_size: int = 1024) -> None:
+        if os.path.exists(path):
+            os.unlink(path)
+        super().__init__(path, CompileHandler)
+        self.cache = ResultCache(cache_size)
+        # PLY keeps its parse state on the parser and lexer objects, so compiles are serialized
+        self.compile_lock = threading.Lock()
+        yacc.get_parser()
+
+    def compile(self, request: Dict) -> Dict:
+        if request.get("stats"):
+            return {"cached": len(self.cache.entries), "hits": self.cache.hits, "misses": self.cache.misses}
+        source = request["source"]
+        tiles = tuple(request.get("reserved", reserved))
+        consts = {int(v): t for v, t in request.get("const_tiles", const_tiles).items()}
+        optimize_for = request.get("optimize_for", "size")
+        inbox = request.get("inbox")
+        key = self.cache.key(source, tiles, consts, optimize_for, inbox and tuple(inbox))
+        result = self.cache.get(key)
+        if result is not None:
+            return dict(result, cached=True)
+        with self.compile_lock:
+            try:
+                hrm, stats = compile_source(source, tiles, consts, optimize_for=optimize_for, inbox=inbox)
+                result = {"hrm": format_code(hrm), "stats": stats}
+            except Exception as e:
+                result = {"error": f"{type(e).__name__}: {e}"}
+        self.cache.put(key, result)
+        return dict(result, cached=False)
+
+    def server_close(self) -> None:
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="keep the compiler warm behind a unix socket")
+    ap.add_argument("-s", "--socket", default=default_socket)
+    ap.add_argument("-c", "--cache-size", type=int, default=1024)
+    args = ap.parse_args()
+    # leave through the with block on kill too, so the socket file is removed
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    with CompileServer(args.socket, args.cache_size) as server:
+        print(f"listening on {args.socket}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
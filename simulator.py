@@ -0,0 +1,117 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+from compiler import Instrument, indirect, lower, upper
+
+
+def resolve_labels(hrm: List[Instrument]) -> Dict[int, int]:
+    labels = {}
+    for i, ins in enumerate(hrm):
+        if ins.code == Instrument.LAB:
+            if ins.arg in labels:
+                raise ValueError(f"label {ins.arg} defined twice")
+            labels[ins.arg] = i
+    return labels
+
+
+def decode(hrm: List[Instrument]) -> List[Tuple[int, int, int]]:
+    # drop labels and turn every jump target into an index of the decoded program
+    labels = resolve_labels(hrm)
+    pos = []
+    count = 0
+    for ins in hrm:
+        pos.append(count)
+        if ins.code != Instrument.LAB:
+            count += 1
+    prog = []
+    for i, ins in enumerate(hrm):
+        if ins.code == Instrument.LAB:
+            continue
+        if Instrument.flags[ins.code] & Instrument.IS_JUMP:
+            if ins.arg not in labels:
+                raise ValueError(f"jump to undefined label {ins.arg}")
+            prog.append((ins.code, pos[labels[ins.arg]], i))
+        else:
+            prog.append((ins.code, ins.arg, i))
+    return prog
+
+
+def simulate(hrm: List[Instrument],
+             inbox: Sequence[int],
+             floor: Optional[Dict[int, int]] = None,
+             max_steps: int = 1000000) -> Tuple[List[int], int, List[int]]:
+    prog = decode(hrm)
+    tiles: List[Optional[int]] = [None] * indirect
+    for t, v in (floor or {}).items():
+        tiles[t] = v
+    outbox = []
+    hits = [0] * len(hrm)
+    hand = None
+    cursor = 0
+    steps = 0
+    pc = 0
+
+    def address(arg: int) -> int:
+        if arg < indirect:
+            return arg
+        p = tiles[arg - indirect]
+        if p is None:
+            raise RuntimeError(f"pointer tile {arg - indirect} is empty")
+        if not 0 <= p < indirect:
+            raise RuntimeError(f"pointer {p} out of floor")
+        return p
+
+    def load(arg: int) -> int:
+        t = address(arg)
+        if tiles[t] is None:
+            raise RuntimeError(f"tile {t} is empty")
+        return tiles[t]
+
+    def held(v: Optional[int], code: int) -> int:
+        if v is None:
+            raise RuntimeError(f"{Instrument.names[code]} with empty hands")
+        return v
+
+    def check(v: int) -> int:
+        if not lower <= v <= upper:
+            raise RuntimeError(f"overflow {v}")
+        return v
+
+    while pc < len(prog):
+        code, arg, idx = prog[pc]
+        if code == Instrument.IN and cursor == len(inbox):
+            break
+        if steps == max_steps:
+            raise RuntimeError(f"exceeded {max_steps} steps")
+        steps += 1
+        hits[idx] += 1
+        pc += 1
+        if code == Instrument.IN:
+            hand = inbox[cursor]
+            cursor += 1
+        elif code == Instrument.OUT:
+            outbox.append(held(hand, code))
+            hand = None
+        elif code == Instrument.CPF:
+            hand = load(arg)
+        elif code == Instrument.CPT:
+            tiles[address(arg)] = held(hand, code)
+        elif code == Instrument.INC:
+            t = address(arg)
+            hand = tiles[t] = check(load(t) + 1)
+        elif code == Instrument.DEC:
+            t = address(arg)
+            hand = tiles[t] = check(load(t) - 1)
+        elif code == Instrument.ADD:
+            hand = check(held(hand, code) + load(arg))
+        elif code == Instrument.SUB:
+            hand = check(held(hand, code) - load(arg))
+        elif code == Instrument.JMP:
+            pc = arg
+        elif code == Instrument.JZ:
+            if held(hand, code) == 0:
+                pc = arg
+        elif code == Instrument.JN:
+            if held(hand, code) < 0:
+                pc = arg
+        else:
+            raise ValueError(f"unknown instrument {code}")
+    return outbox, steps, hits
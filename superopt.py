@@ -0,0 +1,185 @@
+import json
+import os
+from collections import deque
+from typing import Dict, List, Optional, Set, Tuple
+
+from compiler import Instrument, indirect
+from optimizer import acc_dead, build_cfg, liveness, transfer
+
+# a value as coefficients of the hands and of each tile on entry to a window, then a constant
+Form = Tuple[int, ...]
+# (hands, tiles) of a symbolic run; None where nothing known is held
+State = Tuple[Optional[Form], Tuple[Optional[Form], ...]]
+# an instruction with its tile numbered by first use in the window
+Code = Tuple[int, int]
+
+straight = (Instrument.CPF, Instrument.CPT, Instrument.ADD, Instrument.SUB, Instrument.INC, Instrument.DEC)
+
+
+def canonical(window: List[Instrument]) -> Tuple[List[Code], List[int]]:
+    # the window with tiles renumbered by first use, and the tiles in that order
+    tiles: List[int] = []
+    code = []
+    for ins in window:
+        if ins.arg not in tiles:
+            tiles.append(ins.arg)
+        code.append((ins.code, tiles.index(ins.arg)))
+    return code, tiles
+
+
+def execute(state: State, ins: Code, values: Optional[Set[Form]] = None) -> Optional[State]:
+    # the state after ins, or None if ins would read something empty or compute a value
+    # outside values (a value the window never computes might overflow)
+    acc, tiles = state
+    code, t = ins
+    if code == Instrument.CPF:
+        return None if tiles[t] is None else (tiles[t], tiles)
+    if code == Instrument.CPT:
+        return None if acc is None else (acc, tiles[:t] + (acc,) + tiles[t + 1:])
+    if tiles[t] is None:
+        return None
+    if code in (Instrument.ADD, Instrument.SUB):
+        if acc is None:
+            return None
+        s = 1 if code == Instrument.ADD else -1
+        v = tuple(a + s * b for a, b in zip(acc, tiles[t]))
+        return None if values is not None and v not in values else (v, tiles)
+    v = tiles[t][:-1] + (tiles[t][-1] + (1 if code == Instrument.INC else -1),)
+    if values is not None and v not in values:
+        return None
+    return v, tiles[:t] + (v,) + tiles[t + 1:]
+
+
+def entry_state(code: List[Code], n: int) -> State:
+    # the hands and tiles the window reads before writing them are its inputs
+    width = n + 2
+
+    def unit(k: int) -> Form:
+        return tuple(1 if i == k else 0 for i in range(width))
+
+    acc = None
+    tiles: List[Optional[Form]] = [None] * n
+    seen = set()
+    for k, (c, t) in enumerate(code):
+        # every instruction here touches the hands, only COPYTO writes a tile unread
+        if k == 0 and c in (Instrument.CPT, Instrument.ADD, Instrument.SUB):
+            acc = unit(0)
+        if t not in seen and c != Instrument.CPT:
+            tiles[t] = unit(t + 1)
+        seen.add(t)
+    return acc, tuple(tiles)
+
+
+def search(code: List[Code], n: int, live: int, hands: bool) -> Optional[List[Code]]:
+    # the shortest sequence shorter than code that leaves the same values in the live tiles
+    # (and in the hands if they are read later) and computes no value code does not;
+    # None if there is none
+    start = entry_state(code, n)
+    values = {f for f in start[1] if f is not None}
+    if start[0] is not None:
+        values.add(start[0])
+    state: Optional[State] = start
+    for ins in code:
+        state = execute(state, ins)
+        if state is None:
+            # code itself reads an empty tile; leave it to fail as written
+            return None
+        values.add(state[0])
+    goal_acc, goal_tiles = state
+
+    def done(s: State) -> bool:
+        if hands and s[0] != goal_acc:
+            return False
+        return all(s[1][t] == goal_tiles[t] for t in range(n) if live >> t & 1)
+
+    alphabet = [(c, t) for c in straight for t in range(n)]
+    seen = {start}
+    work = deque([(start, [])])
+    while work:
+        s, seq = work.popleft()
+        if done(s):
+            return seq
+        if len(seq) + 1 >= len(code):
+            continue
+        for ins in alphabet:
+            nxt = execute(s, ins, values)
+            if nxt is not None and nxt not in seen:
+                seen.add(nxt)
+                work.append((nxt, seq + [ins]))
+    return None
+
+
+class Superoptimizer:
+    # a pass that replaces each straight-line window of up to `length` COPYFROM/COPYTO/
+    # ADD/SUB/BUMPUP/BUMPDN instructions by the shortest equivalent sequence. Every value is
+    # a linear form over what the window reads, so equivalence is checked symbolically.
+    # Windows are looked up by their canonical form in a cache, which is kept in the JSON
+    # file at `path` by save() so later compiles reuse what earlier ones found.
+    def __init__(self, length: int = 5, path: Optional[str] = None) -> None:
+        self.__name__ = "o_superopt"
+        self.length = length
+        self.path = path
+        self.cache: Dict[str, Optional[List[Code]]] = {}
+        self.found: Dict[str, Optional[List[Code]]] = {}
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self.cache = {k: None if v is None else [tuple(c) for c in v] for k, v in json.load(f).items()}
+
+    def lookup(self, window: List[Instrument], live: int, hands: bool) -> Optional[List[Instrument]]:
+        code, tiles = canonical(window)
+        mask = sum(1 << k for k, t in enumerate(tiles) if live >> t & 1)
+        key = f"{';'.join(f'{c} {t}' for c, t in code)}|{mask}|{int(hands)}"
+        if key not in self.cache:
+            self.cache[key] = self.found[key] = search(code, len(tiles), mask, hands)
+        best = self.cache[key]
+        if best is None:
+            return None
+        return [Instrument(c, tiles[t]) for c, t in best]
+
+    def __call__(self, hrm: List[Instrument]) -> Tuple[bool, List[Instrument]]:
+        blocks = build_cfg(hrm)
+        if len(blocks) == 0:
+            return False, hrm
+        _, live_out = liveness(hrm, blocks)
+        opt = []
+        changed = False
+        for n, b in enumerate(blocks):
+            # tiles live after each instruction of the block
+            after = [0] * (b.end - b.start)
+            live = live_out[n]
+            for i in reversed(range(b.start, b.end)):
+                after[i - b.start] = live
+                live = transfer(hrm[i], live)
+            i = b.start
+            while i < b.end:
+                k = i
+                while k < b.end and k - i < self.length and hrm[k].code in straight and hrm[k].arg < indirect:
+                    k += 1
+                for e in range(k, i + 1, -1):
+                    # hands that are never read again count as dead; reaching the end of
+                    # the block they may still be read
+                    best = self.lookup(hrm[i:e], after[e - 1 - b.start], not acc_dead(hrm, e, b.end))
+                    if best is not None:
+                        opt.extend(best)
+                        i = e
+                        changed = True
+                        break
+                else:
+                    opt.append(hrm[i])
+                    i += 1
+        return changed, opt
+
+    def save(self) -> None:
+        # merged into the file, as other processes may have added their own finds
+        if self.path is None or len(self.found) == 0:
+            return
+        cache = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                cache = json.load(f)
+        cache.update(self.found)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(cache, f)
+        os.replace(tmp, self.path)
+        self.found = {}
@@ -1,5 +1,5 @@
-from typing import List
-from compiler import Add, Addr, Call, Compare, Context, Instrument, Nop, Read, Sub, Write, header
+from build import format_code, make_context, reserved
+from compiler import Call
 from optimizer import optimize
 from yacc import parser
 
@@ -103,9 +103,6 @@ fib a b x
 # """
 ]
 
-def print_code(insts: List[Instrument]) -> None:
-    insts = '\n'.join(str(i) for i in insts)
-    print(f"{header}\n{insts}")
 
 if __name__ == "__main__":
     for test in tests:
@@ -113,28 +110,12 @@ if __name__ == "__main__":
         funcs = parser.parse(test)
 
         entry = Call("main", [])
-        context = Context(
-            [
-                Addr(),
-                Write(),
-                Add(), Sub(),
-                Compare("gt", False, True, False),
-                Compare("ge", True, True, False),
-                Compare("lt", False, True, True, True),
-                Compare("le", True, True, True, True),
-                Compare("eq", True, False, False, True),
-                Compare("neq", True, False, False, False)
-            ],
-            [Read(), Nop()],
-            funcs
-        )
+        context = make_context(funcs)
         try:
             hrm = entry.emit(context)
-            print_code(hrm)
-            opt = True
-            while opt:
-                opt, hrm = optimize(hrm)
-            print_code(hrm)
+            print(format_code(hrm), end="")
+            _, hrm = optimize(hrm, reserved)
+            print(format_code(hrm), end="")
 
         except Exception as e:
             print(e)
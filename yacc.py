@@ -1,7 +1,10 @@
+import os
+import sys
+
 import ply.yacc as yacc
 
-from compiler import (Assignment, Call, DoBlock, Expression, Function, Guards, IfBlock)
-from lex import tokens
+from compiler import (Assignment, Call, Const, DoBlock, Function, Guards, IfBlock, NameRef)
+from lex import get_lexer, tokens
 
 
 def p_PROG(p):
@@ -41,11 +44,11 @@ def p_EXPR(p):
             | IF EXPR THEN EXPR ELSE EXPR
             | CALL"""
     if len(p) == 5:
-        p[0] = Expression(DoBlock(p[3]))
+        p[0] = DoBlock(p[3])
     elif len(p) == 7:
-        p[0] = Expression(IfBlock(p[2], p[4], p[6]))
+        p[0] = IfBlock(p[2], p[4], p[6])
     else:
-        p[0] = Expression(p[1])
+        p[0] = p[1]
 
 
 def p_STMTS(p):
@@ -83,18 +86,12 @@ def p_ARG_CALL(p):
 
 def p_ARG_NAME(p):
     "ARG : NAME"
-    p[0] = {
-        "type": "NAME",
-        "value": str(p[1])
-    }
+    p[0] = NameRef(p[1])
 
 
 def p_ARG_CONST(p):
     "ARG : CONST"
-    p[0] = {
-        "type": "CONST",
-        "value": int(p[1])
-    }
+    p[0] = Const(int(p[1]))
 
 
 def p_empty(p):
@@ -106,4 +103,25 @@ def p_error(p):
     print("Syntax error in input!")
 
 
-parser = yacc.yacc()
+_parser = None
+
+
+def get_parser(write_tables: bool = False) -> yacc.LRParser:
+    # built on first use from parsetab.py next to this file;
+    # run this module to regenerate the tables after changing the grammar
+    global _parser
+    if _parser is None or write_tables:
+        get_lexer()
+        _parser = yacc.yacc(module=sys.modules[__name__], tabmodule="parsetab", debug=False,
+                            write_tables=write_tables, outputdir=os.path.dirname(os.path.abspath(__file__)))
+    return _parser
+
+
+def __getattr__(name: str):
+    if name == "parser":
+        return get_parser()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+if __name__ == "__main__":
+    get_parser(write_tables=True)